@@ -1,56 +1,418 @@
 import asyncio
+import collections
+import datetime
 import logging
+import os
+import random
+import time
 
-from aiogram import types
-from aiogram.utils import exceptions
+import sqlalchemy
+import typing
 
-from app import services
-from app.data.db_session import create_session
-from app.data.models import User, ExamResult
-from app.main import bot
+from app import checkege, metrics, notifier, participant_sessions, results
+from app import stats as score_stats
+from app.data.db_session import reader, writer
+from app.data.models import User, Exam, ExamResult, ExamPublication
+from app.rate_limiter import RateLimiter
+from app.scheduler import PollingScheduler, polling_interval
+from app.sharding import ShardLease
 from app.static import strings
 
 
-async def check_for_new_results():
+# Если передан lease, проверяются только пользователи арендованных процессом шардов. Каждый пользователь
+# проверяется в свой срок, который назначает планировщик (см. app.scheduler)
+async def check_for_new_results(lease: typing.Optional[ShardLease] = None):
     await asyncio.sleep(5)
+    limiter = RateLimiter(float(os.environ.get("CHECKER_RATE_LIMIT", 50)))
+    scheduler = PollingScheduler()
+    publications = {}  # (экзамен, регион) -> время публикации
+    stats = collections.Counter()
+    if lease is not None:
+        # Пользователи потерянных шардов убираются из очереди сразу, а не при следующей синхронизации
+        lease.on_lost.append(lambda shards: _drop_shards(scheduler, lease.count, shards))
+    cycle = 0
+    next_sync = next_canary = 0
     while True:
-        logging.info("AUTOCHECKER: started")
-        new = 0
-        changed = 0
-        errors = 0
-        with create_session() as session:
-            for user in session.query(User).filter(User.status == strings.Status.AUTHORIZED.value):
-                exams = services.get_exams(user.chat_id)
-                if exams is None:
-                    errors += 1
-                    continue
-                for exam in exams:
-                    exam_result = session.query(ExamResult).filter(ExamResult.chat_id == user.chat_id,
-                                                                   ExamResult.exam_id == exam["ExamId"]).first()
-                    if exam["HasResult"] and exam_result.result is None \
-                            and not exam["IsHidden"]:  # В полученных данных результат есть, а в бд - нет
-                        new += 1
-                        exam_result.result = exam["TestMark"]
-                        session.commit()
-                        try:
-                            await bot.send_message(user.chat_id,
-                                                   strings.new_result.format(subject=exam_result.exam.name,
-                                                                             result=exam_result.result),
-                                                   parse_mode=types.ParseMode.MARKDOWN)
-                        except exceptions.BotBlocked:
-                            pass
-                    elif exam["HasResult"] and not exam["IsHidden"] \
-                            and exam_result.result != exam["TestMark"]:
-                        changed += 1
-                        exam_result.result = exam["TestMark"]
-                        session.commit()
-                        try:
-                            await bot.send_message(user.chat_id,
-                                                   strings.result_changed.format(subject=exam_result.exam.name,
-                                                                                 result=exam_result.result),
-                                                   parse_mode=types.ParseMode.MARKDOWN)
-                        except exceptions.BotBlocked:
-                            pass
-                await asyncio.sleep(1)
-        logging.info(f"AUTOCHECKER: finished ({new} new results, {changed} changed, {errors} errors)")
-        await asyncio.sleep(600)
+        if lease is not None:
+            # Общий лимит запросов к checkege делится между живыми процессами автопроверки
+            limiter.rate = float(os.environ.get("CHECKER_RATE_LIMIT", 50)) / lease.workers
+        user_filter = lease.user_filter() if lease is not None else sqlalchemy.true()
+        canary_mode = os.environ.get("CHECKER_MODE", "full") == "canary"
+        batch_size = int(os.environ.get("CHECKER_BATCH_SIZE", 500))
+
+        if time.time() >= next_sync:
+            # Новые и вышедшие пользователи, смена шардов и публикации, замеченные другими процессами
+            if stats:
+                logging.info(f"AUTOCHECKER: {stats['checked']} users checked ({stats['new']} new results, "
+                             f"{stats['changed']} changed, {stats['unchanged']} unchanged, {stats['errors']} errors, "
+                             f"{stats['expired']} sessions expired, {stats['unavailable']} postponed), "
+                             f"{len(scheduler)} users scheduled")
+                logging.info(f"AUTOCHECKER: checkege client stats {checkege.stats()}")
+                stats.clear()
+            await _sync(scheduler, user_filter, publications, canary_mode)
+            next_sync = time.time() + int(os.environ.get("CHECKER_SYNC_INTERVAL", 60))
+
+        if canary_mode and time.time() >= next_canary:
+            users = await _get_canary_users(user_filter, cycle, int(os.environ.get("CHECKER_CANARY_SIZE", 3)))
+            cycle += 1
+            next_canary = time.time() + int(os.environ.get("CHECKER_CANARY_INTERVAL", 60))
+            await _sweep(users, scheduler, user_filter, publications, canary_mode, limiter, stats, lease)
+
+        users = scheduler.pop_due(batch_size)
+        if users:
+            await _sweep(users, scheduler, user_filter, publications, canary_mode, limiter, stats, lease)
+            continue
+        wake_at = min(next_sync, next_canary if canary_mode else next_sync, scheduler.next_due() or next_sync)
+        await asyncio.sleep(max(wake_at - time.time(), 0))
+
+
+# Загружает из БД пользователей, экзамены без результатов и публикации, добавляет новых пользователей
+# в планировщик и убирает вышедших. Новые пользователи распределяются по их первому интервалу
+async def _sync(scheduler: PollingScheduler, user_filter, publications: dict, canary_mode: bool):
+    users, pending, stored_publications = await _load_schedule(user_filter)
+    stale = [chat_id for chat_id, user in users.items() if participant_sessions.is_stale(user.authorized_at)]
+    if stale:
+        await participant_sessions.record_checks([], [], stale)
+    for chat_id in [chat_id for chat_id in scheduler.entries if chat_id not in users or chat_id in stale]:
+        scheduler.remove(chat_id)
+    now = time.time()
+    utcnow = datetime.datetime.utcnow()
+    for chat_id, user in users.items():
+        if chat_id in scheduler:
+            scheduler.update(chat_id, user.participant_cookie, user.region)
+            continue
+        if chat_id in stale:
+            continue
+        exams = pending.get(chat_id, [])
+        published = any(_is_recently_published((exam_id, user.region), stored_publications) for exam_id, _ in exams)
+        errors = user.failed_checks or 0  # Ошибки до перезапуска продолжают увеличивать интервал
+        interval = polling_interval([exam_date for _, exam_date in exams], published, errors, canary_mode)
+        if user.checked_at is not None:
+            # После перезапуска или смены шардов очередь продолжается с того места, где остановилась:
+            # срок считается от последней проверки, просроченные проверяются в порядке просрочки
+            due = now + interval - (utcnow - user.checked_at).total_seconds()
+        else:
+            due = now + random.uniform(0, interval)
+        scheduler.schedule(chat_id, due, user.participant_cookie, user.region)
+        scheduler.pending[chat_id] = exams
+        if errors:
+            scheduler.errors[chat_id] = errors
+        if user.exams_fingerprint is not None:
+            scheduler.fingerprints[chat_id] = (user.exams_validator, user.exams_fingerprint)
+    # Результаты опубликованы, а ожидающие их пользователи с тех пор еще не проверялись
+    new_publications = stored_publications.keys() - publications.keys()
+    for chat_id, exams in pending.items():
+        region = scheduler.region(chat_id)
+        checked_at = users[chat_id].checked_at if chat_id in users else None
+        if any((exam_id, region) in new_publications
+               and (checked_at is None or stored_publications[exam_id, region] > checked_at) for exam_id, _ in exams):
+            scheduler.expedite(chat_id)
+    publications.update(stored_publications)
+
+
+def _drop_shards(scheduler: PollingScheduler, count: int, shards: set):
+    dropped = [chat_id for chat_id in scheduler.entries if chat_id % count in shards]
+    for chat_id in dropped:
+        scheduler.remove(chat_id)
+    metrics.checker_scheduled_users.set(len(scheduler))
+    logging.info(f"AUTOCHECKER: shards {sorted(shards)} lost, {len(dropped)} users unscheduled")
+
+
+# Сразу после публикации результаты ожидающих их пользователей появляются со дня на день: такие пользователи
+# проверяются чаще, пока публикация не станет старше CHECKER_HOT_PERIOD
+def _is_recently_published(pair: tuple, publications: dict) -> bool:
+    published_at = publications.get(pair)
+    return published_at is not None and (datetime.datetime.utcnow() - published_at).total_seconds() \
+        < int(os.environ.get("CHECKER_HOT_PERIOD", 24 * 60 * 60))
+
+
+# Проверяет пользователей пачками и назначает им следующую проверку. Когда у кого-то впервые появляется
+# результат по паре (экзамен, регион), все ожидающие его пользователи проверяются вне очереди
+async def _sweep(users: list, scheduler: PollingScheduler, user_filter, publications: dict, canary_mode: bool,
+                 limiter: RateLimiter, stats: collections.Counter, lease: typing.Optional[ShardLease] = None):
+    batch_size = int(os.environ.get("CHECKER_BATCH_SIZE", 500))
+    owns = lease.owns if lease is not None else lambda chat_id: True
+    for i in range(0, len(users), batch_size):
+        batch = users[i:i + batch_size]
+        started = time.perf_counter()
+        fetched, unchanged, expired, unavailable, fingerprints = await _fetch_batch(batch, scheduler.fingerprints,
+                                                                                   limiter, stats, owns)
+        # Пользователей шардов, потерянных во время пачки, дальше проверяет другой процесс
+        batch = [user for user in batch if owns(user[0])]
+        stats["checked"] += len(batch)
+        stats["unchanged"] += len(unchanged)
+        try:
+            new, changed, new_publications = await _reconcile(fetched, fingerprints)
+        except Exception:
+            logging.exception("AUTOCHECKER: failed to save batch")
+            stats["errors"] += len(fetched)
+            fetched, new_publications = {}, set()
+        else:
+            stats["new"] += new
+            stats["changed"] += changed
+            if new or changed:
+                notifier.wake()
+            for chat_id, exams in fetched.items():
+                if chat_id in scheduler:
+                    scheduler.pending[chat_id] = [(exam["ExamId"], checkege.parse_exam_date(exam))
+                                                  for exam in exams if not exam["HasResult"] or exam["IsHidden"]]
+            scheduler.fingerprints.update(
+                (chat_id, fingerprint) for chat_id, fingerprint in fingerprints.items() if chat_id in scheduler
+            )
+        publications.update(dict.fromkeys(new_publications, datetime.datetime.utcnow()))
+
+        # Истекшие сессии больше не проверяются, пока пользователь заново не авторизуется. Пользователи,
+        # до которых не дошла очередь из-за недоступности checkege, ошибкой не считаются
+        checked = fetched.keys() | unchanged
+        failed = [chat_id for chat_id, _ in batch if chat_id not in checked and chat_id not in expired
+                  and chat_id not in unavailable]
+        metrics.checker_checks.inc(len(fetched), result="fetched")
+        metrics.checker_checks.inc(len(unchanged), result="unchanged")
+        metrics.checker_checks.inc(len(expired), result="expired")
+        metrics.checker_checks.inc(len(failed), result="failed")
+        metrics.checker_checks.inc(len(unavailable), result="unavailable")
+        try:
+            stats["expired"] += await participant_sessions.record_checks(list(checked), failed, list(expired))
+        except Exception:
+            logging.exception("AUTOCHECKER: failed to save session states")
+        for chat_id in expired:
+            scheduler.remove(chat_id)
+
+        retry_at = time.time() + checkege.get_breaker().retry_in()
+        for chat_id, _ in batch:
+            if chat_id in expired:
+                continue
+            if chat_id in unavailable:  # Без увеличения интервала: проверка просто не состоялась
+                if chat_id in scheduler:
+                    scheduler.schedule(chat_id, retry_at)
+                continue
+            region = scheduler.region(chat_id)
+            published = any(_is_recently_published((exam_id, region), publications)
+                            for exam_id, _ in scheduler.pending.get(chat_id, []))
+            scheduler.reschedule(chat_id, chat_id not in checked, published, canary_mode)
+        metrics.checker_batch_seconds.observe(time.perf_counter() - started)
+        metrics.checker_scheduled_users.set(len(scheduler))
+
+        if new_publications:
+            logging.info(f"AUTOCHECKER: results published for {len(new_publications)} exam/region pairs")
+            for chat_id, _ in await _get_fan_out_users(user_filter, new_publications):
+                scheduler.expedite(chat_id)
+
+
+# Пользователи, экзамены без результатов с датами экзаменов и все известные публикации. Пользователи читаются
+# порциями по chat_id, каждая в своей короткой транзакции: длинное чтение мешало бы SQLite очищать WAL
+async def _load_schedule(user_filter) -> tuple:
+    users = {}
+    pending = {}
+    chunk_size = int(os.environ.get("CHECKER_SYNC_CHUNK", 5000))
+    after = None
+    while True:
+        chunk_users, chunk_pending = await _load_schedule_chunk(user_filter, after, chunk_size)
+        users.update(chunk_users)
+        pending.update(chunk_pending)
+        if len(chunk_users) < chunk_size:
+            break
+        after = max(chunk_users)
+    return users, pending, await _get_publications()
+
+
+@reader
+def _load_schedule_chunk(session, user_filter, after: typing.Optional[int], limit: int) -> tuple:
+    in_chunk = User.chat_id > after if after is not None else sqlalchemy.true()
+    users = {
+        user.chat_id: user
+        for user in session.query(
+            User.chat_id, User.participant_cookie, User.region, User.authorized_at, User.failed_checks,
+            User.checked_at, User.exams_validator, User.exams_fingerprint
+        ).filter(User.status == strings.Status.AUTHORIZED.value, user_filter, in_chunk)
+        .order_by(User.chat_id).limit(limit)
+    }
+    pending = collections.defaultdict(list)
+    if not users:
+        return users, pending
+    rows = session.query(ExamResult.chat_id, ExamResult.exam_id, Exam.date) \
+        .join(Exam, Exam.id == ExamResult.exam_id) \
+        .join(User, User.chat_id == ExamResult.chat_id) \
+        .filter(User.status == strings.Status.AUTHORIZED.value, ExamResult.result.is_(None), user_filter, in_chunk,
+                User.chat_id <= max(users))
+    for chat_id, exam_id, exam_date in rows:
+        pending[chat_id].append((exam_id, exam_date))
+    return users, pending
+
+
+@reader
+def _get_publications(session) -> dict:
+    return {(exam_id, region): published_at for exam_id, region, published_at in session.query(
+        ExamPublication.exam_id, ExamPublication.region, ExamPublication.published_at
+    )}
+
+
+# Пользователи для цикла canary: для каждой пары (экзамен, регион), результаты которой еще не опубликованы,
+# берется небольшая выборка ожидающих их пользователей, сдвигающаяся от цикла к циклу. Выборку делает БД:
+# пользователи пары нумеруются по chat_id, и берутся номера start, start + 1, ... по кругу
+@reader
+def _get_canary_users(session, user_filter, cycle: int, sample_size: int) -> list:
+    pair = (ExamResult.exam_id, User.region)
+    waiting = _query_pending(session, user_filter) \
+        .add_columns(sqlalchemy.func.row_number().over(partition_by=pair, order_by=User.chat_id).label("number"),
+                     sqlalchemy.func.count().over(partition_by=pair).label("size")) \
+        .filter(~sqlalchemy.exists().where(ExamPublication.exam_id == ExamResult.exam_id,
+                                           ExamPublication.region == User.region)) \
+        .subquery()
+    start = cycle * sample_size
+    offset = (waiting.c.number - 1 + waiting.c.size - sqlalchemy.literal(start) % waiting.c.size) % waiting.c.size
+    rows = session.query(waiting.c.chat_id, waiting.c.participant_cookie) \
+        .filter(offset < sample_size).order_by(waiting.c.chat_id)
+    return list(dict(rows.all()).items())
+
+
+# Все пользователи, ожидающие результатов по парам (экзамен, регион) из published
+@reader
+def _get_fan_out_users(session, user_filter, published: set) -> list:
+    rows = _query_pending(session, user_filter) \
+        .filter(sqlalchemy.tuple_(ExamResult.exam_id, User.region).in_(list(published))).order_by(User.chat_id)
+    return list(dict(rows.all()).items())
+
+
+def _query_pending(session, user_filter):
+    return session.query(User.chat_id, User.participant_cookie) \
+        .join(ExamResult, ExamResult.chat_id == User.chat_id) \
+        .filter(User.status == strings.Status.AUTHORIZED.value, ExamResult.result.is_(None), user_filter)
+
+
+# Запрашивает экзамены пользователей пачки пулом воркеров с общим ограничением частоты запросов к checkege
+# Возвращает изменившиеся экзамены, пользователей без изменений, с истекшими сессиями и не проверенных из-за
+# недоступности checkege, а также новые (ETag или Last-Modified, отпечаток), которые нужно сохранить
+async def _fetch_batch(users: list, fingerprints: dict, limiter: RateLimiter, stats: collections.Counter,
+                       owns: typing.Callable[[int], bool] = lambda chat_id: True) -> tuple:
+    queue = asyncio.Queue()
+    for user in users:
+        queue.put_nowait(user)
+    result = ({}, set(), set(), set(), {})
+    concurrency = min(int(os.environ.get("CHECKER_CONCURRENCY", 20)), len(users))
+    await asyncio.gather(*(_worker(queue, fingerprints, limiter, result, stats, owns)
+                           for _ in range(concurrency)))
+    return result
+
+
+async def _worker(queue: asyncio.Queue, fingerprints: dict, limiter: RateLimiter, result: tuple,
+                  stats: collections.Counter, owns: typing.Callable[[int], bool]):
+    fetched, unchanged, expired, unavailable, new_fingerprints = result
+    jitter = float(os.environ.get("CHECKER_JITTER", 1))
+    while not queue.empty():
+        chat_id, participant_cookie = queue.get_nowait()
+        try:
+            await asyncio.sleep(random.uniform(0, jitter))
+            await checkege.wait_until_available()  # Пока checkege недоступен, проверка приостанавливается
+            await limiter.acquire()
+            if not owns(chat_id):  # Шард отдан другому процессу, пока пользователь ждал очереди
+                continue
+            validator, fingerprint = fingerprints.get(chat_id, (None, None))
+            exams, new_validator, new_fingerprint = await checkege.get_exams_if_changed(participant_cookie, validator,
+                                                                                       fingerprint)
+        except checkege.SessionExpiredError:
+            expired.add(chat_id)
+            continue
+        except checkege.UnavailableError:
+            unavailable.add(chat_id)
+            stats["unavailable"] += 1
+            continue
+        except Exception:
+            logging.exception(f"AUTOCHECKER: failed to check user {chat_id}")
+            exams = None
+        if exams is None:
+            stats["errors"] += 1
+            continue
+        if exams is checkege.NOT_MODIFIED:
+            unchanged.add(chat_id)
+        else:
+            fetched[chat_id] = exams
+        if (new_validator, new_fingerprint) != (validator, fingerprint):
+            new_fingerprints[chat_id] = (new_validator, new_fingerprint)
+
+
+# Сверяет полученные результаты с БД для всей пачки: одна выборка, сравнение в памяти и один массовый UPDATE.
+# Уведомления ставятся в очередь в той же транзакции. Заодно отмечаются опубликованные пары (экзамен, регион)
+@writer
+def _reconcile(session, fetched: dict, fingerprints: dict) -> tuple:
+    messages = []
+    new = 0
+    changed = 0
+    published = set()
+    if fingerprints:
+        # Отпечатки сохраняются вместе с результатами: иначе после ошибки изменения были бы приняты за старые
+        session.bulk_update_mappings(User, [
+            {"chat_id": chat_id, "exams_validator": validator, "exams_fingerprint": fingerprint}
+            for chat_id, (validator, fingerprint) in fingerprints.items()
+        ])
+    if not fetched:
+        return new, changed, published
+
+    stored = {}
+    rows = session.query(ExamResult.id, ExamResult.chat_id, ExamResult.exam_id, ExamResult.result, Exam.name) \
+        .join(Exam, Exam.id == ExamResult.exam_id) \
+        .filter(ExamResult.chat_id.in_(list(fetched)))
+    for row in rows:
+        stored[row.chat_id, row.exam_id] = row
+    known_exams = dict(session.query(Exam.id, Exam.date))
+    regions = dict(session.query(User.chat_id, User.region).filter(User.chat_id.in_(list(fetched))))
+
+    updates = []
+    inserts = []
+    changes = []  # Для распределений баллов (app.stats)
+    dates = {}
+    for chat_id, exams in fetched.items():
+        for exam in exams:
+            if exam["ExamId"] in known_exams and known_exams[exam["ExamId"]] is None:
+                dates[exam["ExamId"]] = checkege.parse_exam_date(exam)
+            has_result = exam["HasResult"] and not exam["IsHidden"]
+            row = stored.get((chat_id, exam["ExamId"]))
+            if exam["HasResult"] and regions.get(chat_id) is not None:
+                published.add((exam["ExamId"], regions.get(chat_id)))
+            if row is None:  # Экзамен появился после регистрации пользователя
+                if exam["ExamId"] not in known_exams:
+                    known_exams[exam["ExamId"]] = checkege.parse_exam_date(exam)
+                    session.add(Exam(id=exam["ExamId"], name=exam["Subject"], date=known_exams[exam["ExamId"]]))
+                inserts.append({"chat_id": chat_id, "exam_id": exam["ExamId"],
+                                "result": exam["TestMark"] if has_result else None})
+                if has_result:
+                    new += 1
+                    changes.append((exam["ExamId"], regions.get(chat_id), None, exam["TestMark"]))
+                    messages.append((chat_id, strings.new_result.format(subject=exam["Subject"],
+                                                                        result=exam["TestMark"])))
+            elif has_result and row.result is None:  # В полученных данных результат есть, а в бд - нет
+                new += 1
+                updates.append({"id": row.id, "result": exam["TestMark"]})
+                changes.append((exam["ExamId"], regions.get(chat_id), None, exam["TestMark"]))
+                messages.append((chat_id, strings.new_result.format(subject=row.name, result=exam["TestMark"])))
+            elif has_result and row.result != exam["TestMark"]:
+                changed += 1
+                updates.append({"id": row.id, "result": exam["TestMark"]})
+                changes.append((exam["ExamId"], regions.get(chat_id), row.result, exam["TestMark"]))
+                messages.append((chat_id, strings.result_changed.format(subject=row.name,
+                                                                        result=exam["TestMark"])))
+
+    session.flush()
+    if updates:
+        session.bulk_update_mappings(ExamResult, updates)
+    dates = [{"id": exam_id, "date": exam_date} for exam_id, exam_date in dates.items() if exam_date is not None]
+    if dates:
+        session.bulk_update_mappings(Exam, dates)
+    if inserts:
+        session.bulk_insert_mappings(ExamResult, inserts)
+    results.update_snapshots(session, {row["chat_id"] for row in inserts} | {chat_id for chat_id, _ in messages})
+    score_stats.record(session, changes)
+    notifier.enqueue(session, messages)
+
+    if published:
+        published -= {(exam_id, region) for exam_id, region in session.query(
+            ExamPublication.exam_id, ExamPublication.region
+        ).filter(ExamPublication.exam_id.in_({exam_id for exam_id, _ in published}))}
+        try:
+            with session.begin_nested():
+                session.bulk_insert_mappings(ExamPublication, [
+                    {"exam_id": exam_id, "region": region} for exam_id, region in published
+                ])
+        except sqlalchemy.exc.IntegrityError:
+            pass  # С общей БД (PostgreSQL) ту же публикацию мог только что записать другой процесс автопроверки
+    return new, changed, published
@@ -0,0 +1,104 @@
+import asyncio
+import base64
+import collections
+import logging
+import os
+import time
+import typing
+
+from app import checkege, metrics
+
+
+# Запас свежих капч checkege: фоновая задача (run) держит до size пар (токен, картинка) не старше ttl секунд,
+# и регистрация получает капчу без запроса к checkege. Пополняется запас только когда он не полон и капчи
+# брали не больше idle секунд назад (и после запуска): без регистраций он не пополняется, а пустеет по мере
+# устаревания капч. Если запас пуст, капча запрашивается напрямую
+class CaptchaPool:
+    def __init__(self, size: int, ttl: float, concurrency: int, idle: float):
+        self.size = size
+        self.ttl = ttl
+        self.concurrency = concurrency
+        self.idle = idle
+        self.items = collections.deque()  # (время получения, токен, картинка), в порядке получения
+        self.wanted = asyncio.Event()  # Запас уменьшился и его пора пополнить
+        self.taken_at = time.monotonic()  # Когда капчу брали последний раз
+        self.stats = collections.Counter()
+
+    def get(self) -> typing.Optional[typing.Tuple[str, bytes]]:
+        self._drop_expired()
+        self.taken_at = time.monotonic()
+        self.wanted.set()
+        if not self.items:
+            self.stats["misses"] += 1
+            metrics.captcha_pool_requests.inc(result="miss")
+            return None
+        self.stats["hits"] += 1
+        metrics.captcha_pool_requests.inc(result="hit")
+        _, token, image = self.items.popleft()
+        return token, image
+
+    async def run(self):
+        while True:
+            self._drop_expired()
+            if len(self.items) >= self.size or time.monotonic() - self.taken_at >= self.idle:
+                self.wanted.clear()
+                # Без запросов капча может только устареть: тогда запас пополняется, когда истечет самая старая.
+                # Пустой запас без спроса ждет следующей регистрации
+                timeout = self.items[0][0] + self.ttl - time.monotonic() if self.items else None
+                try:
+                    await asyncio.wait_for(self.wanted.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await checkege.wait_until_available()
+            count = min(self.concurrency, self.size - len(self.items))
+            captchas = await asyncio.gather(*(fetch() for _ in range(count)), return_exceptions=True)
+            fetched = [captcha for captcha in captchas if isinstance(captcha, tuple)]
+            self.items.extend((time.monotonic(), token, image) for token, image in fetched)
+            self.stats["fetched"] += len(fetched)
+            if not fetched:
+                await asyncio.sleep(5)
+
+    def _drop_expired(self):
+        deadline = time.monotonic() - self.ttl
+        while self.items and self.items[0][0] < deadline:
+            self.items.popleft()
+            self.stats["expired"] += 1
+
+
+# Запрашивает капчу у checkege: (токен, картинка) или None
+async def fetch() -> typing.Optional[typing.Tuple[str, bytes]]:
+    data = await checkege.get_captcha()
+    if data is None:
+        return None
+    return data["Token"], base64.b64decode(data["Image"])
+
+
+__pool: typing.Optional[CaptchaPool] = None
+
+
+def get_pool() -> CaptchaPool:
+    global __pool
+
+    if __pool is None:
+        ttl = float(os.environ.get("CAPTCHA_POOL_TTL", 60))
+        __pool = CaptchaPool(int(os.environ.get("CAPTCHA_POOL_SIZE", 20)), ttl,
+                             int(os.environ.get("CAPTCHA_POOL_CONCURRENCY", 4)),
+                             float(os.environ.get("CAPTCHA_POOL_IDLE", 5 * ttl)))
+    return __pool
+
+
+# Капча из запаса, а если он пуст (или отключен, CAPTCHA_POOL_SIZE=0) - напрямую от checkege
+async def get_captcha() -> typing.Optional[typing.Tuple[str, bytes]]:
+    captcha = get_pool().get()
+    if captcha is None:
+        captcha = await fetch()
+    return captcha
+
+
+async def run():
+    pool = get_pool()
+    if pool.size <= 0:
+        return
+    logging.info(f"CAPTCHA POOL: keeping {pool.size} captchas for {pool.ttl} s")
+    await pool.run()
@@ -0,0 +1,250 @@
+import asyncio
+import collections
+import datetime
+import hashlib
+import json
+import logging
+import os
+import random
+import typing
+from http.cookies import SimpleCookie
+
+import aiohttp
+from multidict import CIMultiDict, CIMultiDictProxy
+
+from app import metrics
+from app.circuit_breaker import CircuitBreaker
+
+try:
+    import orjson as fast_json  # Необязательная зависимость, разбирает ответы checkege в несколько раз быстрее
+except ImportError:
+    fast_json = json
+
+EXAM_FIELDS = ("ExamId", "Subject", "ExamDate", "HasResult", "IsHidden", "TestMark")
+NOT_MODIFIED = "not modified"
+_NO_HEADERS = CIMultiDictProxy(CIMultiDict())
+
+__session: typing.Optional[aiohttp.ClientSession] = None
+__breaker: typing.Optional[CircuitBreaker] = None
+__stats = collections.Counter()
+
+
+# checkege больше не принимает cookie участника: нужно заново пройти авторизацию
+class SessionExpiredError(Exception):
+    pass
+
+
+# Запрос не отправлялся: circuit breaker открыт или ждет завершения пробного запроса
+class UnavailableError(Exception):
+    pass
+
+
+def get_session() -> aiohttp.ClientSession:
+    global __session
+
+    if __session is None or __session.closed:
+        connector = aiohttp.TCPConnector(limit=int(os.environ.get("CHECK_EGE_MAX_CONNECTIONS", 100)),
+                                         keepalive_timeout=float(os.environ.get("CHECK_EGE_KEEPALIVE", 60)),
+                                         ttl_dns_cache=300)
+        timeout = aiohttp.ClientTimeout(total=float(os.environ.get("CHECK_EGE_TIMEOUT", 15)),
+                                        connect=float(os.environ.get("CHECK_EGE_CONNECT_TIMEOUT", 5)))
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_connection_create_end.append(_on_connection_created)
+        trace_config.on_connection_reuseconn.append(_on_connection_reused)
+        # Cookie участников передаются вручную в заголовках, общий cookie jar не нужен:
+        # иначе cookie одного пользователя уходили бы в запросы другого
+        __session = aiohttp.ClientSession(connector=connector, timeout=timeout, trace_configs=[trace_config],
+                                          cookie_jar=aiohttp.DummyCookieJar())
+    return __session
+
+
+def get_breaker() -> CircuitBreaker:
+    global __breaker
+
+    if __breaker is None:
+        __breaker = CircuitBreaker(int(os.environ.get("CHECK_EGE_BREAKER_THRESHOLD", 10)),
+                                   float(os.environ.get("CHECK_EGE_BREAKER_TIMEOUT", 60)))
+        for state in (CircuitBreaker.CLOSED, CircuitBreaker.OPEN, CircuitBreaker.HALF_OPEN):
+            metrics.checkege_breaker_state.set_function(lambda state=state: int(get_breaker().state == state),
+                                                        state=state)
+    return __breaker
+
+
+async def close():
+    global __session
+
+    if __session is not None and not __session.closed:
+        await __session.close()
+    __session = None
+
+
+# Ждет, пока checkege снова можно будет опрашивать: circuit breaker закрыт или готов к пробному запросу,
+# а не ждет ответа на уже отправленный пробный
+async def wait_until_available():
+    breaker = get_breaker()
+    while breaker.is_blocked():
+        await asyncio.sleep(breaker.retry_in() + 0.1)
+
+
+def stats() -> dict:
+    breaker = get_breaker()
+    return {
+        **__stats,
+        "breaker_state": breaker.state,
+        "breaker_opened": breaker.times_opened,
+    }
+
+
+async def _on_connection_created(session, context, params):
+    __stats["connections_created"] += 1
+    metrics.checkege_connections.inc(kind="created")
+
+
+async def _on_connection_reused(session, context, params):
+    __stats["connections_reused"] += 1
+    metrics.checkege_connections.inc(kind="reused")
+
+
+# Выполняет запрос с повторами при ошибках соединения, таймаутах и ответах 5xx.
+# Возвращает статус, тело, заголовки и cookie ответа; статус None, если запрос так и не удался.
+# Если circuit breaker не пропускает запрос, бросает UnavailableError
+async def _request(method: str, url: str, name: str, **kwargs) -> typing.Tuple[typing.Optional[int], bytes,
+                                                                             CIMultiDictProxy, SimpleCookie]:
+    breaker = get_breaker()
+    retries = int(os.environ.get("CHECK_EGE_RETRIES", 2))
+    backoff = float(os.environ.get("CHECK_EGE_BACKOFF", 0.5))
+    for attempt in range(retries + 1):
+        if not breaker.allow():
+            __stats["rejected"] += 1
+            raise UnavailableError(f"{name}: checkege is unavailable, retry in {breaker.retry_in():.0f} s")
+        if attempt:
+            __stats["retries"] += 1
+        __stats["requests"] += 1
+        trial = breaker.trial_in_progress
+        try:
+            response, error = await _attempt(method, url, **kwargs)
+            if response is not None:
+                breaker.record_success()
+                return response
+            __stats["failures"] += 1
+            opened = breaker.times_opened
+            breaker.record_failure()
+            if breaker.times_opened > opened:
+                metrics.checkege_breaker_opened.inc()
+        finally:
+            if trial:  # Отмена или непредвиденная ошибка не должны оставить breaker полуоткрытым навсегда
+                breaker.end_trial()
+        if attempt < retries:
+            await asyncio.sleep(backoff * 2 ** attempt * random.uniform(1, 1.5))
+    logging.error(f"{name}: {error}")
+    return None, b"", _NO_HEADERS, SimpleCookie()
+
+
+# Один запрос: ответ (статус < 500) или описание ошибки
+async def _attempt(method: str, url: str, **kwargs) -> tuple:
+    try:
+        async with get_session().request(method, url, **kwargs) as r:
+            body = await r.read()
+            if r.status < 500:
+                return (r.status, body, r.headers, r.cookies), None
+            return None, f"{r.status} - {body.decode(errors='replace')}"
+    except asyncio.TimeoutError:
+        return None, "Timeout"
+    except aiohttp.ClientError as e:
+        return None, f"ConnectionError ({e.__class__.__name__})"
+
+
+async def get_exams(participant_cookie) -> typing.Optional[list]:
+    try:
+        exams, _, _ = await get_exams_if_changed(participant_cookie)
+    except UnavailableError as e:
+        logging.error(str(e))
+        return None
+    return exams
+
+
+# Условный запрос экзаменов. validator - ETag или Last-Modified прошлого ответа, fingerprint - отпечаток прошлых
+# экзаменов. Возвращает экзамены (только поля EXAM_FIELDS, None при ошибке), новые validator и fingerprint.
+# Если экзамены не изменились (ответ 304 или тот же отпечаток), вместо них возвращается NOT_MODIFIED.
+# Пока checkege недоступен, бросает UnavailableError: проверка не выполнялась, и ошибкой пользователя это не считается
+@metrics.checkege_seconds.timed(endpoint="exam")
+async def get_exams_if_changed(participant_cookie, validator: typing.Optional[str] = None,
+                               fingerprint: typing.Optional[str] = None) -> tuple:
+    headers = {
+        "Cookie": f"Participant={participant_cookie}",
+        "User-Agent": os.environ.get("USER_AGENT"),
+    }
+    if validator is not None:
+        if validator.startswith(('"', 'W/"')):
+            headers["If-None-Match"] = validator
+        else:
+            headers["If-Modified-Since"] = validator
+    status, body, response_headers, _ = await _request("GET", os.environ.get("CHECK_EGE_EXAM_URL"), "EXAM",
+                                                       headers=headers)
+    if status is None:
+        return None, validator, fingerprint
+    if status == 304:
+        __stats["not_modified"] += 1
+        return NOT_MODIFIED, validator, fingerprint
+    if status == 401:
+        raise SessionExpiredError()
+    if status >= 400:
+        logging.error(f"EXAM: {status} {body.decode(errors='replace')}")
+        return None, validator, fingerprint
+
+    validator = response_headers.get("ETag") or response_headers.get("Last-Modified")
+    exams = [{field: exam.get(field) for field in EXAM_FIELDS} for exam in fast_json.loads(body)["Result"]["Exams"]]
+    new_fingerprint = exams_fingerprint(exams)
+    if new_fingerprint == fingerprint:
+        __stats["unchanged"] += 1
+        return NOT_MODIFIED, validator, fingerprint
+    return exams, validator, new_fingerprint
+
+
+# Отпечаток полей, от которых зависят уведомления: не меняется от порядка экзаменов и остальных полей ответа
+def exams_fingerprint(exams: list) -> str:
+    normalized = sorted((exam["ExamId"], bool(exam["HasResult"]), bool(exam["IsHidden"]), exam["TestMark"])
+                        for exam in exams)
+    return hashlib.blake2b(repr(normalized).encode(), digest_size=16).hexdigest()
+
+
+# Дата экзамена из ответа checkege ("2021-06-03T00:00:00") или None, если ее нет
+def parse_exam_date(exam: dict) -> typing.Optional[datetime.datetime]:
+    try:
+        return datetime.datetime.fromisoformat(exam["ExamDate"][:19])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+@metrics.checkege_seconds.timed(endpoint="captcha")
+async def get_captcha() -> typing.Optional[dict]:
+    try:
+        status, body, _, _ = await _request("GET", os.environ.get("CHECK_EGE_CAPTCHA_URL"), "CAPTCHA")
+    except UnavailableError as e:
+        logging.error(str(e))
+        return None
+    if status is None:
+        return None
+    if status >= 400:
+        logging.error(f"CAPTCHA: {status} - {body.decode(errors='replace')}")
+        return None
+    return json.loads(body)
+
+
+# Возвращает HTTP-статус ответа (None при ошибке соединения) и cookie участника
+@metrics.checkege_seconds.timed(endpoint="login")
+async def log_in(data: dict) -> typing.Tuple[typing.Optional[int], typing.Optional[str]]:
+    try:
+        status, body, _, cookies = await _request("POST", os.environ.get("CHECK_EGE_LOGIN_URL"), "AUTHORIZATION",
+                                                  data=data)
+    except UnavailableError as e:
+        logging.error(str(e))
+        return None, None
+    if status is None:
+        return None, None
+    if status >= 400:
+        if status != 401:
+            logging.error(f"AUTHORIZATION: {status} - {body.decode(errors='replace')}")
+        return status, None
+    cookie = cookies.get("Participant")
+    return status, cookie.value if cookie is not None else None
@@ -0,0 +1,69 @@
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+
+from app import auto_checker, checkege, config, metrics
+from app.data import db_session
+from app.sharding import ShardLease
+
+
+async def run_worker(index: int = 0):
+    db_session.global_init()
+    metrics_port = int(os.environ.get("METRICS_PORT", 0))
+    # Бот занимает METRICS_PORT, процессы автопроверки - следующие порты по порядку
+    metrics_server = await metrics.start_server(metrics_port + 1 + index if metrics_port else 0)
+    heartbeat_interval = float(os.environ.get("CHECKER_HEARTBEAT_INTERVAL", 10))
+    lease = ShardLease(int(os.environ.get("CHECKER_SHARDS", 16)), ttl=3 * heartbeat_interval)
+    await lease.renew()
+    heartbeat = asyncio.ensure_future(lease.run(heartbeat_interval))
+    checker = asyncio.ensure_future(auto_checker.check_for_new_results(lease))
+    asyncio.get_event_loop().add_signal_handler(signal.SIGTERM, checker.cancel)
+    try:
+        await checker
+    except asyncio.CancelledError:
+        pass
+    finally:
+        heartbeat.cancel()
+        await lease.release()  # Шарды сразу достаются другим процессам, не дожидаясь истечения аренды
+        await checkege.close()
+        if metrics_server is not None:
+            await metrics_server.cleanup()
+        logging.info(f"CHECKER: worker {lease.worker_id} stopped")
+
+
+def _worker_main(index: int):
+    # Остановкой управляет родительский процесс: по Ctrl+C он присылает воркерам SIGTERM
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    config.load_env()
+    config.setup_logging()
+    asyncio.run(run_worker(index))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Автопроверка результатов ЕГЭ")
+    parser.add_argument("--processes", type=int, help="число процессов (по умолчанию CHECKER_PROCESSES или 1)")
+    args = parser.parse_args()
+    config.load_env()
+    processes = args.processes or int(os.environ.get("CHECKER_PROCESSES", 1))
+
+    context = multiprocessing.get_context("spawn")
+    workers = [context.Process(target=_worker_main, args=(i,), name=f"checker-{i}") for i in range(processes)]
+    for worker in workers:
+        worker.start()
+
+    def stop(signum, frame):
+        for worker in workers:
+            if worker.is_alive():
+                os.kill(worker.pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for worker in workers:
+        worker.join()
+
+
+if __name__ == "__main__":
+    main()
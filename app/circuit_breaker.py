@@ -0,0 +1,61 @@
+import time
+
+
+# После threshold подряд неудачных запросов перестает пропускать запросы на reset_timeout секунд,
+# затем пропускает один пробный запрос: при успехе снова работает как обычно, при неудаче - еще reset_timeout секунд
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, threshold: int, reset_timeout: float):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_progress = False
+        self.times_opened = 0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return self.CLOSED
+        if time.monotonic() - self.opened_at < self.reset_timeout:
+            return self.OPEN
+        return self.HALF_OPEN
+
+    # Сколько секунд осталось до пробного запроса
+    def retry_in(self) -> float:
+        if self.opened_at is None:
+            return 0
+        return max(0.0, self.opened_at + self.reset_timeout - time.monotonic())
+
+    # Запросы сейчас не пройдут: breaker открыт или пробный запрос еще не завершился
+    def is_blocked(self) -> bool:
+        state = self.state
+        return state == self.OPEN or state == self.HALF_OPEN and self.trial_in_progress
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == self.CLOSED:
+            return True
+        if state == self.HALF_OPEN and not self.trial_in_progress:
+            self.trial_in_progress = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_progress = False
+
+    # Пробный запрос прерван без ответа (например, отменен): следующий запрос снова может стать пробным
+    def end_trial(self):
+        self.trial_in_progress = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.trial_in_progress or (self.opened_at is None and self.failures >= self.threshold):
+            self.opened_at = time.monotonic()
+            self.times_opened += 1
+        self.trial_in_progress = False
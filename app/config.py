@@ -0,0 +1,30 @@
+import logging
+import os
+
+from dotenv import load_dotenv
+
+
+# Путь к файлу можно переопределить переменной ENV_FILE (например, для бенчмарков)
+def load_env():
+    dotenv_path = os.environ.get("ENV_FILE") or os.path.join(os.path.dirname(__file__), "..", ".env")
+    if os.path.exists(dotenv_path):
+        load_dotenv(dotenv_path)
+    else:
+        raise FileNotFoundError(".env file not found")
+
+
+# Id экзамена-сочинения: его результат - зачет, а не балл
+def essay_id() -> int:
+    value = os.environ.get("ESSAY_ID")
+    if not value:
+        raise RuntimeError("ESSAY_ID is not set: add the id of the essay exam to .env")
+    return int(value)
+
+
+def setup_logging():
+    logger = logging.getLogger()
+    logger.setLevel(logging.INFO)
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("[%(asctime)s] %(levelname)s:%(name)s:%(message)s"))
+    logger.handlers.clear()
+    logger.addHandler(handler)
@@ -0,0 +1,93 @@
+import datetime
+import logging
+
+import sqlalchemy as sa
+
+from app.data.db_session import db
+
+# Версионированные миграции схемы. Номер последней примененной миграции хранится в schema_migrations, поэтому
+# запуск с актуальной схемой обходится одним запросом. Новая миграция добавляется в конец MIGRATIONS и после
+# выпуска не меняется. Миграции должны быть идемпотентными: на новой БД таблицы, добавленные поздними
+# миграциями, уже создала первая
+
+_metadata = sa.MetaData()  # Отдельно от моделей: таблица версий не копируется app.data.copy_db
+schema_migrations = sa.Table(
+    "schema_migrations", _metadata,
+    sa.Column("version", sa.Integer, primary_key=True, autoincrement=False),
+    sa.Column("name", sa.String, nullable=False),
+    sa.Column("applied_at", sa.DateTime, nullable=False),
+)
+
+
+# Добавляет к существующей таблице недостающие столбцы модели (они должны допускать NULL)
+def _add_columns(conn: sa.engine.Connection, table: sa.Table):
+    columns = {column["name"] for column in sa.inspect(conn).get_columns(table.name)}
+    for column in table.columns:
+        if column.name not in columns:
+            column_type = column.type.compile(dialect=conn.dialect)
+            conn.execute(sa.text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+
+
+# Приводит БД любой из версий бота, выпущенных до появления миграций, к текущей схеме. create_all не добавляет
+# столбцы и индексы к уже существующим таблицам, поэтому недостающие создаются отдельно
+def _baseline(conn: sa.engine.Connection):
+    db.metadata.create_all(conn)
+    inspector = sa.inspect(conn)
+    for table in db.metadata.sorted_tables:
+        _add_columns(conn, table)
+        indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in indexes:
+                continue
+            if table.name == "exam_results" and index.unique:
+                # Повторная регистрация раньше добавляла дубликаты результатов, оставляем самые ранние
+                conn.execute(sa.text("DELETE FROM exam_results WHERE id NOT IN "
+                                     "(SELECT MIN(id) FROM exam_results GROUP BY chat_id, exam_id)"))
+            index.create(conn)
+
+
+# Распределения баллов (app.stats) заполняются по уже сохраненным результатам
+def _exam_stats(conn: sa.engine.Connection):
+    from app import stats
+
+    db.metadata.tables["exam_stats"].create(conn, checkfirst=True)
+    stats.rebuild(conn)
+
+
+# Уведомления закрепляются за отправляющим их процессом бота (app.notifier)
+def _notification_claims(conn: sa.engine.Connection):
+    _add_columns(conn, db.metadata.tables["notifications"])
+
+
+# Счетчик неудачных попыток отправки уведомления (app.notifier)
+def _notification_attempts(conn: sa.engine.Connection):
+    _add_columns(conn, db.metadata.tables["notifications"])
+
+
+# Черновики регистрации в БД (app.drafts, REGISTRATION_DRAFT_STORE="db")
+def _registration_drafts(conn: sa.engine.Connection):
+    db.metadata.tables["registration_drafts"].create(conn, checkfirst=True)
+
+
+MIGRATIONS = [
+    (1, "baseline", _baseline),
+    (2, "exam_stats", _exam_stats),
+    (3, "notification_claims", _notification_claims),
+    (4, "registration_drafts", _registration_drafts),
+    (5, "notification_attempts", _notification_attempts),
+]
+
+
+def migrate(engine: sa.engine.Engine):
+    with engine.begin() as conn:  # В SQLite это BEGIN IMMEDIATE: одновременно запущенные процессы ждут друг друга
+        schema_migrations.create(conn, checkfirst=True)
+        if conn.dialect.name == "postgresql":
+            conn.execute(sa.text("LOCK TABLE schema_migrations IN EXCLUSIVE MODE"))
+        current = conn.execute(sa.select(sa.func.max(schema_migrations.c.version))).scalar() or 0
+        for version, name, migration in MIGRATIONS:
+            if version <= current:
+                continue
+            logging.info(f"DB: applying migration {version} ({name})")
+            migration(conn)
+            conn.execute(schema_migrations.insert().values(version=version, name=name,
+                                                           applied_at=datetime.datetime.utcnow()))
@@ -1,3 +1,10 @@
+from app.data.models.checker_shard import CheckerShard
+from app.data.models.checker_worker import CheckerWorker
 from app.data.models.exam import Exam
+from app.data.models.exam_publication import ExamPublication
 from app.data.models.exam_result import ExamResult
+from app.data.models.exam_stats import ExamStats
+from app.data.models.notification import Notification
+from app.data.models.registration_draft import RegistrationDraft
+from app.data.models.results_snapshot import ResultsSnapshot
 from app.data.models.user import User
@@ -0,0 +1,12 @@
+import sqlalchemy
+
+from app.data.db_session import db
+
+
+# Шард пользователей автопроверки (chat_id % число шардов) и процесс, который его сейчас обрабатывает
+class CheckerShard(db):
+    __tablename__ = "checker_shards"
+
+    shard = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True, autoincrement=False)
+    owner = sqlalchemy.Column(sqlalchemy.String)
+    heartbeat_at = sqlalchemy.Column(sqlalchemy.DateTime)
@@ -0,0 +1,11 @@
+import sqlalchemy
+
+from app.data.db_session import db
+
+
+# Живой процесс автопроверки: по числу таких процессов делятся шарды и лимит запросов к checkege
+class CheckerWorker(db):
+    __tablename__ = "checker_workers"
+
+    worker_id = sqlalchemy.Column(sqlalchemy.String, primary_key=True)
+    heartbeat_at = sqlalchemy.Column(sqlalchemy.DateTime)
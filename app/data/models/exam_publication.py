@@ -0,0 +1,14 @@
+import datetime
+
+import sqlalchemy
+
+from app.data.db_session import db
+
+
+# Экзамен (exam_id), результаты которого уже опубликованы в регионе region
+class ExamPublication(db):
+    __tablename__ = "exam_publications"
+
+    exam_id = sqlalchemy.Column(sqlalchemy.Integer, sqlalchemy.ForeignKey("exams.id"), primary_key=True)
+    region = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True)
+    published_at = sqlalchemy.Column(sqlalchemy.DateTime, default=datetime.datetime.utcnow)
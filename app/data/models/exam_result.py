@@ -1,14 +1,17 @@
 import sqlalchemy
 from sqlalchemy import orm
 
-from app.data.db_session import db
+from app.data.db_session import ChatId, db
 
 
 class ExamResult(db):
     __tablename__ = "exam_results"
+    __table_args__ = (
+        sqlalchemy.Index("ix_exam_results_chat_id_exam_id", "chat_id", "exam_id", unique=True),
+    )
 
     id = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True, autoincrement=True)
-    chat_id = sqlalchemy.Column(sqlalchemy.Integer, sqlalchemy.ForeignKey("users.chat_id"))
+    chat_id = sqlalchemy.Column(ChatId, sqlalchemy.ForeignKey("users.chat_id"))
     exam_id = sqlalchemy.Column(sqlalchemy.Integer, sqlalchemy.ForeignKey("exams.id"))
     result = sqlalchemy.Column(sqlalchemy.Integer)
 
@@ -0,0 +1,13 @@
+import sqlalchemy
+
+from app.data.db_session import db
+
+
+# Распределение баллов по экзамену: сколько сохраненных результатов равно 0, 1, ..., 100. Строка с region = 0 -
+# по всем регионам. Обновляется вместе с exam_results (см. app.stats)
+class ExamStats(db):
+    __tablename__ = "exam_stats"
+
+    exam_id = sqlalchemy.Column(sqlalchemy.Integer, sqlalchemy.ForeignKey("exams.id"), primary_key=True)
+    region = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True)
+    histogram = sqlalchemy.Column(sqlalchemy.LargeBinary, nullable=False)  # 101 счетчик uint32, little-endian
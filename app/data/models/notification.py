@@ -0,0 +1,20 @@
+import datetime
+
+import sqlalchemy
+
+from app.data.db_session import ChatId, db
+
+
+class Notification(db):
+    __tablename__ = "notifications"
+
+    id = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True, autoincrement=True)
+    chat_id = sqlalchemy.Column(ChatId, nullable=False)
+    text = sqlalchemy.Column(sqlalchemy.String, nullable=False)
+    created_at = sqlalchemy.Column(sqlalchemy.DateTime, default=datetime.datetime.utcnow)
+    # Процесс бота, который отправляет уведомление, и до какого времени оно за ним закреплено (см. app.notifier)
+    claimed_by = sqlalchemy.Column(sqlalchemy.String)
+    claimed_until = sqlalchemy.Column(sqlalchemy.DateTime)
+    # Неудачные попытки отправки и время следующей: до него уведомление и остальные уведомления чата ждут
+    attempts = sqlalchemy.Column(sqlalchemy.Integer)
+    next_attempt_at = sqlalchemy.Column(sqlalchemy.DateTime)
@@ -0,0 +1,12 @@
+import sqlalchemy
+
+from app.data.db_session import ChatId, db
+
+
+# Черновик регистрации, если черновики хранятся в БД, общей для нескольких процессов бота (см. app.drafts)
+class RegistrationDraft(db):
+    __tablename__ = "registration_drafts"
+
+    chat_id = sqlalchemy.Column(ChatId, primary_key=True, autoincrement=False)
+    data = sqlalchemy.Column(sqlalchemy.String, nullable=False)  # JSON черновика
+    expires_at = sqlalchemy.Column(sqlalchemy.DateTime, nullable=False, index=True)
@@ -0,0 +1,12 @@
+import sqlalchemy
+
+from app.data.db_session import ChatId, db
+
+
+# Денормализованные результаты пользователя для /results: обновляются вместе с exam_results (см. app.results)
+class ResultsSnapshot(db):
+    __tablename__ = "results_snapshots"
+
+    chat_id = sqlalchemy.Column(ChatId, sqlalchemy.ForeignKey("users.chat_id"), primary_key=True)
+    results = sqlalchemy.Column(sqlalchemy.String, nullable=False)  # JSON: [[exam_id, предмет, балл или null], ...]
+    text = sqlalchemy.Column(sqlalchemy.String, nullable=False)  # Готовый текст ответа на /results
@@ -1,13 +1,13 @@
 import sqlalchemy
 from sqlalchemy import orm
 
-from app.data.db_session import db
+from app.data.db_session import ChatId, db
 
 
 class User(db):
     __tablename__ = "users"
 
-    chat_id = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True)
+    chat_id = sqlalchemy.Column(ChatId, primary_key=True, autoincrement=False)
     namehash = sqlalchemy.Column(sqlalchemy.String)
     document = sqlalchemy.Column(sqlalchemy.String)
     region = sqlalchemy.Column(sqlalchemy.Integer)
@@ -15,5 +15,10 @@ class User(db):
     captcha_token = sqlalchemy.Column(sqlalchemy.String)
     participant_cookie = sqlalchemy.Column(sqlalchemy.String)
     status = sqlalchemy.Column(sqlalchemy.Integer)
+    authorized_at = sqlalchemy.Column(sqlalchemy.DateTime)  # Когда получен participant_cookie
+    failed_checks = sqlalchemy.Column(sqlalchemy.Integer, default=0)  # Неудачных проверок подряд
+    checked_at = sqlalchemy.Column(sqlalchemy.DateTime)  # Последняя удачная проверка: по ней восстанавливается очередь
+    exams_validator = sqlalchemy.Column(sqlalchemy.String)  # ETag или Last-Modified последнего ответа checkege
+    exams_fingerprint = sqlalchemy.Column(sqlalchemy.String)  # Отпечаток экзаменов из этого ответа
 
     exam_results = orm.relation("ExamResult", back_populates="user", cascade="all, delete")
@@ -0,0 +1,113 @@
+import abc
+import collections
+import datetime
+import json
+import os
+import time
+import typing
+
+from app.data.db_session import reader, writer
+from app.data.models import RegistrationDraft
+
+
+# Черновики регистрации: то, что пользователь вводит на шагах NAME -> DOCUMENT -> REGION -> CAPTCHA, хранится
+# здесь, а в таблицу users попадает одной транзакцией только после успешной авторизации на checkege (см. services).
+# Брошенный черновик исчезает через ttl секунд после последнего изменения
+class DraftStore(abc.ABC):
+    @abc.abstractmethod
+    async def get(self, chat_id) -> typing.Optional[dict]:
+        ...
+
+    @abc.abstractmethod
+    async def put(self, chat_id, draft: dict):
+        ...
+
+    @abc.abstractmethod
+    async def delete(self, chat_id):
+        ...
+
+
+# Черновики в памяти процесса бота. Записи упорядочены по последнему изменению, поэтому устаревшие
+# и лишние (сверх max_size) удаляются с начала
+class MemoryDraftStore(DraftStore):
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.entries = collections.OrderedDict()  # chat_id -> (срок хранения, черновик)
+
+    async def get(self, chat_id) -> typing.Optional[dict]:
+        entry = self.entries.get(chat_id)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del self.entries[chat_id]
+            return None
+        return dict(entry[1])  # Копия: изменения сохраняются только через put
+
+    async def put(self, chat_id, draft: dict):
+        self.entries[chat_id] = (time.monotonic() + self.ttl, dict(draft))
+        self.entries.move_to_end(chat_id)
+        now = time.monotonic()
+        while self.entries and (len(self.entries) > self.max_size or next(iter(self.entries.values()))[0] < now):
+            self.entries.popitem(last=False)
+
+    async def delete(self, chat_id):
+        self.entries.pop(chat_id, None)
+
+
+# Черновики в таблице registration_drafts: общие для всех процессов бота с одной БД, поэтому шаги регистрации
+# одного пользователя могут обрабатывать разные процессы. Устаревшие черновики удаляются при записи новых
+class DatabaseDraftStore(DraftStore):
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+
+    async def get(self, chat_id) -> typing.Optional[dict]:
+        data = await _get_draft(chat_id)
+        return json.loads(data) if data is not None else None
+
+    async def put(self, chat_id, draft: dict):
+        await _put_draft(chat_id, json.dumps(draft, ensure_ascii=False, separators=(",", ":")), self.ttl)
+
+    async def delete(self, chat_id):
+        await _delete_draft(chat_id)
+
+
+@reader
+def _get_draft(session, chat_id) -> typing.Optional[str]:
+    return session.query(RegistrationDraft.data) \
+        .filter(RegistrationDraft.chat_id == chat_id,
+                RegistrationDraft.expires_at >= datetime.datetime.utcnow()).scalar()
+
+
+@writer
+def _put_draft(session, chat_id, data: str, ttl: float):
+    now = datetime.datetime.utcnow()
+    session.query(RegistrationDraft).filter(RegistrationDraft.expires_at < now).delete(synchronize_session=False)
+    session.merge(RegistrationDraft(chat_id=chat_id, data=data, expires_at=now + datetime.timedelta(seconds=ttl)))
+
+
+@writer
+def _delete_draft(session, chat_id):
+    session.query(RegistrationDraft).filter(RegistrationDraft.chat_id == chat_id).delete(synchronize_session=False)
+
+
+__store: typing.Optional[DraftStore] = None
+
+
+def get_store() -> DraftStore:
+    global __store
+
+    if __store is None:
+        ttl = float(os.environ.get("REGISTRATION_DRAFT_TTL", 3600))
+        if os.environ.get("REGISTRATION_DRAFT_STORE", "memory") == "db":
+            __store = DatabaseDraftStore(ttl)
+        else:
+            __store = MemoryDraftStore(ttl, int(os.environ.get("REGISTRATION_DRAFT_MAX", 100000)))
+    return __store
+
+
+# Подменяет хранилище черновиков, например, другим внешним
+def set_store(store: DraftStore):
+    global __store
+
+    __store = store
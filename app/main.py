@@ -1,48 +1,48 @@
 import asyncio
-import logging
 import os
 
-from aiogram import Bot, Dispatcher, executor, types
-from dotenv import load_dotenv
+from aiogram import Bot, Dispatcher, types
+from aiogram.bot.api import TELEGRAM_PRODUCTION, TelegramAPIServer
 
-from app import services, auto_checker
+from app import services, captcha_pool, checkege, config, metrics, notifier, updates
 from app.data import db_session
 from app.static import strings, keyboards
 
-dotenv_path = os.path.join(os.path.dirname(__file__), "..", ".env")
-if os.path.exists(dotenv_path):
-    load_dotenv(dotenv_path)
-else:
-    raise FileNotFoundError(".env file not found")
+config.load_env()
+config.setup_logging()
 
-logger = logging.getLogger()
-logger.setLevel(logging.INFO)
-handler = logging.StreamHandler()
-handler.setFormatter(logging.Formatter("[%(asctime)s] %(levelname)s:%(name)s:%(message)s"))
-logger.handlers.clear()
-logger.addHandler(handler)
-
-bot = Bot(token=os.environ.get("BOT_API_TOKEN"))
+# TELEGRAM_API_URL - адрес собственного сервера Bot API (или заглушки из bench) вместо api.telegram.org
+bot = Bot(token=os.environ.get("BOT_API_TOKEN"), server=TelegramAPIServer.from_base(os.environ["TELEGRAM_API_URL"])
+          if os.environ.get("TELEGRAM_API_URL") else TELEGRAM_PRODUCTION)
 dp = Dispatcher(bot)
+dp.middleware.setup(updates.HandlerMetricsMiddleware())
 
 
 @dp.message_handler(commands=["start"])
 @dp.message_handler(regexp=strings.start)
 async def send_welcome(message: types.Message):
-    if services.is_user_authorized(message.chat.id):
+    if await services.is_user_authorized(message.chat.id):
         await message.answer(strings.start_for_authorized, parse_mode=types.ParseMode.MARKDOWN)
     else:
         await message.answer(strings.welcome, parse_mode=types.ParseMode.MARKDOWN)
         await message.answer(strings.input_name, parse_mode=types.ParseMode.MARKDOWN,
                              reply_markup=types.ReplyKeyboardRemove())
-        services.start(message.chat.id)
+        await services.start(message.chat.id)
 
 
 @dp.message_handler(commands=["results"])
 @dp.message_handler(regexp=strings.results)
 async def send_results(message: types.Message):
-    if services.is_user_authorized(message.chat.id):
-        await message.answer(services.get_text_results(message.chat.id), parse_mode=types.ParseMode.MARKDOWN)
+    if await services.is_user_authorized(message.chat.id):
+        await message.answer(await services.get_text_results(message.chat.id), parse_mode=types.ParseMode.MARKDOWN)
+    else:
+        await message.answer(strings.for_not_authorized, parse_mode=types.ParseMode.MARKDOWN)
+
+
+@dp.message_handler(commands=["stats"])
+async def send_stats(message: types.Message):
+    if await services.is_user_authorized(message.chat.id):
+        await message.answer(await services.get_text_stats(message.chat.id), parse_mode=types.ParseMode.MARKDOWN)
     else:
         await message.answer(strings.for_not_authorized, parse_mode=types.ParseMode.MARKDOWN)
 
@@ -50,8 +50,8 @@ async def send_results(message: types.Message):
 @dp.message_handler(commands=["logout"])
 @dp.message_handler(regexp=strings.logout)
 async def logout(message: types.Message):
-    if services.is_user_authorized(message.chat.id):
-        services.delete_user(message.chat.id)
+    if await services.get_user_status(message.chat.id) in (strings.Status.AUTHORIZED, strings.Status.SESSION_EXPIRED):
+        await services.delete_user(message.chat.id)
         await message.answer(strings.successfully_deleted, parse_mode=types.ParseMode.MARKDOWN,
                              reply_markup=keyboards.for_unauthorized_users)
     else:
@@ -73,33 +73,34 @@ async def hide_region_list(callback_query: types.CallbackQuery):
 
 @dp.message_handler()
 async def handle(message: types.Message):
-    status = services.get_user_status(message.chat.id)
+    status = await services.get_user_status(message.chat.id)
     if status == strings.Status.NAME:
-        if services.set_name(message.chat.id, message.text):
+        if await services.set_name(message.chat.id, message.text):
             await message.answer(strings.input_document, parse_mode=types.ParseMode.MARKDOWN)
         else:
             await message.answer(strings.incorrect_name_format, parse_mode=types.ParseMode.MARKDOWN)
     elif status == strings.Status.DOCUMENT:
-        if services.set_document(message.chat.id, message.text):
+        if await services.set_document(message.chat.id, message.text):
             await message.answer(strings.input_region, parse_mode=types.ParseMode.MARKDOWN,
                                  reply_markup=keyboards.view_region_list_inline)
         else:
             await message.answer(strings.incorrect_document_format, parse_mode=types.ParseMode.MARKDOWN)
     elif status == strings.Status.REGION:
-        if services.set_region(message.chat.id, message.text):
-            await message.answer(strings.confirm_region.format(region=services.get_region(message.chat.id)),
+        if await services.set_region(message.chat.id, message.text):
+            await message.answer(strings.confirm_region.format(region=await services.get_region(message.chat.id)),
                                  parse_mode=types.ParseMode.MARKDOWN)
-            captcha_img = services.set_captcha(message.chat.id)
+            captcha_img = await services.set_captcha(message.chat.id)
             if captcha_img:
                 await bot.send_photo(message.chat.id, captcha_img, caption=strings.input_captcha)
         else:
             await message.answer(strings.incorrect_region_format, parse_mode=types.ParseMode.MARKDOWN)
     elif status == strings.Status.CAPTCHA:
-        if services.set_captcha_answer(message.chat.id, message.text):
-            if services.log_in(message.chat.id):
-                success = services.save_initial_exams(message.chat.id)
+        if await services.set_captcha_answer(message.chat.id, message.text):
+            if await services.log_in(message.chat.id):
+                success = await services.save_initial_exams(message.chat.id)
                 if success:
-                    await message.answer(strings.successful_authorization + services.get_text_results(message.chat.id),
+                    text_results = await services.get_text_results(message.chat.id)
+                    await message.answer(strings.successful_authorization + text_results,
                                          parse_mode=types.ParseMode.MARKDOWN, reply_markup=keyboards.for_authorized_users)
                 else:
                     await message.answer(strings.authorization_denied, parse_mode=types.ParseMode.MARKDOWN)
@@ -111,9 +112,27 @@ async def handle(message: types.Message):
         await message.answer(strings.for_authorized, parse_mode=types.ParseMode.MARKDOWN)
     elif status == strings.Status.AUTHORIZATION_ERROR:
         await message.answer(strings.authorization_error, parse_mode=types.ParseMode.MARKDOWN)
+    elif status == strings.Status.SESSION_EXPIRED:
+        # Данные участника сохранены, для новой авторизации достаточно ввести капчу
+        captcha_img = await services.set_captcha(message.chat.id)
+        if captcha_img:
+            await bot.send_photo(message.chat.id, captcha_img, caption=strings.input_captcha)
+
+
+async def on_shutdown():
+    await checkege.close()
+    await (await bot.get_session()).close()
 
 
 if __name__ == "__main__":
     db_session.global_init()
-    asyncio.get_event_loop().create_task(auto_checker.check_for_new_results())
-    executor.start_polling(dp, skip_updates=True)
+    if os.environ.get("CHECKER_EMBEDDED", "0") == "1":
+        # Обычно автопроверка запускается отдельно (python -m app.checker), а бот только отвечает на сообщения
+        from app import auto_checker
+
+        asyncio.get_event_loop().create_task(auto_checker.check_for_new_results())
+    asyncio.get_event_loop().create_task(notifier.run(bot))
+    asyncio.get_event_loop().create_task(captcha_pool.run())
+    asyncio.get_event_loop().create_task(metrics.start_server(int(os.environ.get("METRICS_PORT", 0))))
+    asyncio.get_event_loop().run_until_complete(updates.run(dp))
+    asyncio.get_event_loop().run_until_complete(on_shutdown())
@@ -0,0 +1,205 @@
+import asyncio
+import collections
+import contextlib
+import functools
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+import typing
+
+if typing.TYPE_CHECKING:
+    from aiohttp import web
+
+
+# Метрики в текстовом формате Prometheus: каждый процесс (бот, процессы автопроверки) отдает свои на /metrics.
+# На /profile?seconds=N можно включить на время семплирующий профайлер, он вернет стеки в формате flamegraph
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+_registry = []
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self.lock = threading.Lock()  # Метрики обновляются и из потоков работы с БД
+        _registry.append(self)
+
+    def render(self) -> list:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str):
+        super().__init__(name, documentation)
+        self.values = collections.Counter()
+
+    def inc(self, amount: float = 1, **labels):
+        with self.lock:
+            self.values[_labels(labels)] += amount
+
+    def render(self) -> list:
+        with self.lock:
+            return super().render() + [f"{self.name}{labels} {value}" for labels, value in self.values.items()]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str):
+        super().__init__(name, documentation)
+        self.values = {}
+
+    def set(self, value: float, **labels):
+        with self.lock:
+            self.values[_labels(labels)] = value
+
+    # Значение, которое вычисляется при каждом запросе метрик (например, зависящее от времени состояние)
+    def set_function(self, func: typing.Callable[[], float], **labels):
+        with self.lock:
+            self.values[_labels(labels)] = func
+
+    def render(self) -> list:
+        with self.lock:
+            values = list(self.values.items())
+        return super().render() + [f"{self.name}{labels} {value() if callable(value) else value}"
+                                   for labels, value in values]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, documentation)
+        self.buckets = buckets
+        self.values = {}  # метки -> [счетчики по корзинам..., сумма, количество]
+
+    def observe(self, value: float, **labels):
+        key = _labels(labels)
+        with self.lock:
+            counts = self.values.get(key)
+            if counts is None:
+                counts = self.values[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    # Замеряет время выполнения блока with
+    @contextlib.contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    # Декоратор для корутин
+    def timed(self, **labels):
+        def decorator(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                with self.time(**labels):
+                    return await func(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def render(self) -> list:
+        lines = super().render()
+        with self.lock:
+            for labels, counts in self.values.items():
+                for bound, count in zip(self.buckets, counts):
+                    lines.append(f"{self.name}_bucket{_add_label(labels, 'le', bound)} {count}")
+                lines.append(f"{self.name}_bucket{_add_label(labels, 'le', '+Inf')} {counts[-1]}")
+                lines.append(f"{self.name}_sum{labels} {counts[-2]}")
+                lines.append(f"{self.name}_count{labels} {counts[-1]}")
+        return lines
+
+
+def _labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in sorted(labels.items())) + "}"
+
+
+def _add_label(labels: str, name: str, value) -> str:
+    label = f'{name}="{value}"'
+    return "{" + label + "}" if not labels else labels[:-1] + "," + label + "}"
+
+
+def render() -> str:
+    return "\n".join(line for metric in _registry for line in metric.render()) + "\n"
+
+
+checkege_seconds = Histogram("checkege_request_seconds", "Время запроса к checkege с повторами")
+checkege_breaker_state = Gauge("checkege_breaker_state", "Состояние circuit breaker checkege (1 - текущее)")
+checkege_breaker_opened = Counter("checkege_breaker_opened_total", "Сколько раз circuit breaker checkege открывался")
+checkege_connections = Counter("checkege_connections_total", "Соединения с checkege: новые (created) и повторно "
+                                                             "использованные (reused)")
+db_session_seconds = Histogram("db_session_seconds", "Время жизни сессии БД")
+db_write_queue = Gauge("db_write_queue", "Операции записи, ожидающие пишущего потока")
+handler_seconds = Histogram("handler_seconds", "Время обработки сообщения ботом")
+captcha_pool_requests = Counter("captcha_pool_requests_total", "Капчи, выданные из запаса (hit) и мимо него (miss)")
+bot_updates_pending = Gauge("bot_updates_pending", "Принятые, но еще не обработанные обновления Telegram")
+checker_batch_seconds = Histogram("checker_batch_seconds", "Время проверки пачки пользователей")
+checker_checks = Counter("checker_checks_total", "Проверки пользователей по итогам")
+checker_lag_seconds = Histogram("checker_lag_seconds", "Насколько позже назначенного началась проверка")
+checker_scheduled_users = Gauge("checker_scheduled_users", "Пользователи в очереди проверок")
+notifier_queue = Gauge("notifier_queue", "Неотправленные уведомления")
+notifier_lag_seconds = Histogram("notifier_lag_seconds", "Время от обнаружения результата до отправки уведомления")
+telegram_send_seconds = Histogram("telegram_send_seconds", "Время отправки сообщения в Telegram")
+
+
+# Семплирующий профайлер: раз в interval секунд снимает стек потока и считает одинаковые стеки
+def profile(thread_id: int, seconds: float, interval: float = 0.005) -> str:
+    stacks = collections.Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        frame = sys._current_frames().get(thread_id)
+        if frame is not None:
+            stacks[";".join(f"{entry.name} ({os.path.basename(entry.filename)}:{entry.lineno})"
+                            for entry in traceback.extract_stack(frame))] += 1
+        time.sleep(interval)
+    return "\n".join(f"{stack} {count}" for stack, count in stacks.most_common()) + "\n"
+
+
+async def _handle_metrics(request: "web.Request") -> "web.Response":
+    from aiohttp import web
+
+    return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+
+
+async def _handle_profile(request: "web.Request") -> "web.Response":
+    from aiohttp import web
+
+    seconds = min(float(request.query.get("seconds", 10)), 300)
+    loop_thread = threading.get_ident()  # Профилируется поток event loop, сам профайлер работает в другом
+    text = await asyncio.get_event_loop().run_in_executor(None, profile, loop_thread, seconds)
+    return web.Response(text=text, content_type="text/plain", charset="utf-8")
+
+
+# Запускает HTTP-сервер метрик на localhost, если порт задан (0 - не запускать). aiohttp.web импортируется
+# только здесь, чтобы процессы без сервера метрик его не загружали
+async def start_server(port: int) -> typing.Optional["web.AppRunner"]:
+    if not port:
+        return None
+    from aiohttp import web
+
+    app = web.Application()
+    app.router.add_get("/metrics", _handle_metrics)
+    app.router.add_get("/profile", _handle_profile)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, os.environ.get("METRICS_HOST", "127.0.0.1"), port).start()
+    logging.info(f"METRICS: listening on port {port}")
+    return runner
@@ -0,0 +1,193 @@
+import asyncio
+import datetime
+import logging
+import os
+import socket
+import time
+import typing
+
+import sqlalchemy
+
+from app import metrics
+from app.data.db_session import reader, writer
+from app.data.models import Notification
+from app.rate_limiter import RateLimiter
+
+# aiogram нужен только процессу, который отправляет уведомления: процессы автопроверки лишь пополняют очередь
+# (enqueue) и не должны тратить время на его импорт
+if typing.TYPE_CHECKING:
+    from aiogram import Bot
+
+__wakeup: typing.Optional[asyncio.Event] = None
+__worker_id = f"{socket.gethostname()}:{os.getpid()}"
+
+
+# Добавляет уведомления в очередь в рамках переданной сессии, чтобы они сохранялись в одной транзакции с результатами
+def enqueue(session, notifications: typing.Iterable[typing.Tuple[int, str]]):
+    session.bulk_insert_mappings(Notification, [
+        {"chat_id": chat_id, "text": text} for chat_id, text in notifications
+    ])
+
+
+def wake():
+    if __wakeup is not None:
+        __wakeup.set()
+
+
+async def run(bot: "Bot"):
+    global __wakeup
+    from aiogram.utils import exceptions
+
+    __wakeup = asyncio.Event()
+    limiter = RateLimiter(float(os.environ.get("NOTIFIER_RATE_LIMIT", 30)))
+    chat_interval = float(os.environ.get("NOTIFIER_CHAT_INTERVAL", 1))
+    batch_size = int(os.environ.get("NOTIFIER_BATCH_SIZE", 300))
+    claim_ttl = float(os.environ.get("NOTIFIER_CLAIM_TTL", 60))
+    max_attempts = int(os.environ.get("NOTIFIER_MAX_ATTEMPTS", 10))
+    retry_delay = float(os.environ.get("NOTIFIER_RETRY_DELAY", 30))
+    queue_metric_interval = float(os.environ.get("METRICS_QUEUE_INTERVAL", 15))
+    next_allowed = {}  # chat_id -> время, раньше которого в этот чат писать нельзя
+    next_queue_count = 0
+    while True:
+        if time.monotonic() >= next_queue_count:
+            # Длину очереди считает полный проход по таблице, поэтому не на каждой пачке
+            next_queue_count = time.monotonic() + queue_metric_interval
+            try:
+                metrics.notifier_queue.set(await _count_queue())
+            except Exception:
+                logging.exception("NOTIFIER: failed to count pending notifications")
+        try:
+            pending = await _claim(__worker_id, batch_size, claim_ttl)
+        except Exception:
+            logging.exception("NOTIFIER: failed to load pending notifications")
+            pending = []
+        if not pending:
+            __wakeup.clear()
+            try:
+                # Очередь могут пополнять и другие процессы, поэтому БД периодически опрашивается и без сигнала
+                await asyncio.wait_for(__wakeup.wait(), timeout=5)
+            except asyncio.TimeoutError:
+                pass
+            continue
+
+        done = []
+        failed = []  # (id, попыток, время следующей попытки)
+        deferred = set()
+        failures = 0
+        for notification_id, chat_id, text, created_at, attempts in pending:
+            now = time.monotonic()
+            if chat_id in deferred or next_allowed.get(chat_id, 0) > now:
+                deferred.add(chat_id)  # Порядок сообщений внутри чата сохраняется
+                continue
+            try:
+                await _send(bot, limiter, chat_id, text, claim_ttl)
+            except (exceptions.Unauthorized, exceptions.BadRequest) as e:  # Бот заблокирован, чат удален и т.п.
+                logging.info(f"NOTIFIER: dropped message to {chat_id} ({e})")
+            except Exception:
+                logging.exception(f"NOTIFIER: failed to send message to {chat_id}")
+                attempts = (attempts or 0) + 1
+                if attempts < max_attempts:
+                    # Уведомление откладывается, а остальные чаты пачки продолжают получать свои
+                    retry_in = min(retry_delay * 2 ** (attempts - 1), 3600)
+                    failed.append((notification_id, attempts,
+                                   datetime.datetime.utcnow() + datetime.timedelta(seconds=retry_in)))
+                    deferred.add(chat_id)
+                    failures += 1
+                    if failures >= 3:  # Ошибки подряд: скорее всего, недоступен сам Telegram
+                        break
+                    continue
+                logging.warning(f"NOTIFIER: dropped message to {chat_id} after {attempts} attempts")
+            else:
+                metrics.notifier_lag_seconds.observe((datetime.datetime.utcnow() - created_at).total_seconds())
+            failures = 0
+            done.append(notification_id)
+            next_allowed[chat_id] = time.monotonic() + chat_interval
+
+        finished = set(done) | {notification_id for notification_id, _, _ in failed}
+        unsent = [notification_id for notification_id, *_ in pending if notification_id not in finished]
+        try:
+            await _finish(done, unsent, failed)
+        except Exception:
+            logging.exception("NOTIFIER: failed to save sent notifications")
+        now = time.monotonic()
+        for chat_id in [chat_id for chat_id, t in next_allowed.items() if t <= now]:
+            del next_allowed[chat_id]
+        if failures >= 3:
+            await asyncio.sleep(5)
+        elif not done:  # Все сообщения пачки ждут ограничения частоты для своих чатов
+            await asyncio.sleep(chat_interval)
+
+
+async def _send(bot: "Bot", limiter: RateLimiter, chat_id, text, claim_ttl: float):
+    from aiogram import types
+    from aiogram.utils import exceptions
+
+    while True:
+        await limiter.acquire()
+        try:
+            with metrics.telegram_send_seconds.time():
+                await bot.send_message(chat_id, text, parse_mode=types.ParseMode.MARKDOWN)
+            return
+        except exceptions.RetryAfter as e:
+            logging.warning(f"NOTIFIER: flood control, sleeping {e.timeout} s")
+            # Ожидание может быть дольше аренды: без продления уведомления пачки забрал бы и повторил другой процесс
+            try:
+                await _extend_claims(__worker_id, e.timeout + claim_ttl)
+            except Exception:
+                logging.exception("NOTIFIER: failed to extend claims")
+            await asyncio.sleep(e.timeout)
+
+
+# Закрепляет за процессом до limit уведомлений на ttl секунд и возвращает их. Очередь могут разбирать несколько
+# процессов бота с общей БД: закрепленные другим процессом уведомления и все уведомления тех же чатов
+# пропускаются, поэтому сообщения не дублируются, а внутри чата уходят по порядку. Так же пропускаются чаты,
+# уведомление в которые ждет повторной попытки
+@writer
+def _claim(session, worker_id: str, limit: int, ttl: float) -> list:
+    now = datetime.datetime.utcnow()
+    busy_chats = session.query(Notification.chat_id) \
+        .filter(sqlalchemy.or_(sqlalchemy.and_(Notification.claimed_until > now, Notification.claimed_by != worker_id),
+                               Notification.next_attempt_at > now))
+    rows = session.query(Notification.id, Notification.chat_id, Notification.text, Notification.created_at,
+                         Notification.attempts) \
+        .filter(sqlalchemy.or_(Notification.claimed_until.is_(None), Notification.claimed_until <= now,
+                               Notification.claimed_by == worker_id),
+                Notification.chat_id.notin_(busy_chats)) \
+        .order_by(Notification.id).limit(limit) \
+        .with_for_update(skip_locked=True).all()  # В SQLite пишущие транзакции и так идут по одной
+    if rows:
+        session.query(Notification).filter(Notification.id.in_([row.id for row in rows])) \
+            .update({"claimed_by": worker_id, "claimed_until": now + datetime.timedelta(seconds=ttl)},
+                    synchronize_session=False)
+    return rows
+
+
+# Продлевает еще не истекшую аренду уведомлений процесса на ttl секунд от текущего момента
+@writer
+def _extend_claims(session, worker_id: str, ttl: float):
+    now = datetime.datetime.utcnow()
+    session.query(Notification) \
+        .filter(Notification.claimed_by == worker_id, Notification.claimed_until > now) \
+        .update({"claimed_until": now + datetime.timedelta(seconds=ttl)}, synchronize_session=False)
+
+
+@reader
+def _count_queue(session) -> int:
+    return session.query(Notification).count()
+
+
+# Удаляет отправленные уведомления, откладывает неудавшиеся (failed - [(id, попыток, время следующей попытки)])
+# и освобождает остальные, чтобы их мог взять любой процесс
+@writer
+def _finish(session, sent: list, unsent: list, failed: list = ()):
+    if sent:
+        session.query(Notification).filter(Notification.id.in_(sent)).delete(synchronize_session=False)
+    if unsent:
+        session.query(Notification).filter(Notification.id.in_(unsent)) \
+            .update({"claimed_by": None, "claimed_until": None}, synchronize_session=False)
+    if failed:
+        session.bulk_update_mappings(Notification, [
+            {"id": notification_id, "attempts": attempts, "next_attempt_at": next_attempt_at,
+             "claimed_by": None, "claimed_until": None}
+            for notification_id, attempts, next_attempt_at in failed
+        ])
@@ -0,0 +1,47 @@
+import datetime
+import os
+import typing
+
+import sqlalchemy
+
+from app import notifier
+from app.data.db_session import writer
+from app.data.models import User
+from app.static import strings
+
+
+# Жизненный цикл cookie участников checkege. Cookie, которую checkege больше не принимает (ответ 401) или которая
+# старше SESSION_MAX_AGE, считается истекшей: пользователь переводится в статус SESSION_EXPIRED, перестает
+# проверяться и получает одно сообщение с просьбой заново ввести капчу
+
+
+def is_stale(authorized_at: typing.Optional[datetime.datetime]) -> bool:
+    max_age = float(os.environ.get("SESSION_MAX_AGE", 0))
+    return max_age > 0 and authorized_at is not None \
+        and (datetime.datetime.utcnow() - authorized_at).total_seconds() > max_age
+
+
+# Записывает итоги проверок пачки: checked - удачные, failed - неудачные, expired - истекшие сессии.
+# Возвращает число пользователей, чьи сессии истекли только что
+@writer
+def record_checks(session, checked: list, failed: list, expired: list) -> int:
+    if checked:
+        session.query(User).filter(User.chat_id.in_(checked)).update(
+            {User.checked_at: datetime.datetime.utcnow(), User.failed_checks: 0}, synchronize_session=False
+        )
+    if failed:
+        session.query(User).filter(User.chat_id.in_(failed)).update(
+            {User.failed_checks: sqlalchemy.func.coalesce(User.failed_checks, 0) + 1}, synchronize_session=False
+        )
+    if not expired:
+        return 0
+    expired = [chat_id for chat_id, in session.query(User.chat_id).filter(
+        User.chat_id.in_(expired), User.status == strings.Status.AUTHORIZED.value
+    )]
+    if expired:
+        session.query(User).filter(User.chat_id.in_(expired)).update(
+            {User.status: strings.Status.SESSION_EXPIRED.value, User.participant_cookie: None},
+            synchronize_session=False
+        )
+        notifier.enqueue(session, [(chat_id, strings.session_expired) for chat_id in expired])
+    return len(expired)
@@ -0,0 +1,29 @@
+import asyncio
+import time
+
+
+# Token bucket: не более rate запросов в секунду с допустимым всплеском burst
+class RateLimiter:
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.capacity = max(burst, 1)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        if self.rate <= 0:  # Ограничение отключено
+            return
+        async with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            # Разрешение накопится ровно через wait и сразу расходуется. Пересчитывать токены после ожидания
+            # нельзя: из-за округления их может оказаться чуть меньше 1, и ожидание повторялось бы без конца
+            wait = (1 - self.tokens) / self.rate
+            self.tokens = 0
+            self.updated = now + wait
+            await asyncio.sleep(wait)
@@ -0,0 +1,175 @@
+import collections
+import functools
+import json
+import os
+import re
+import typing
+
+from app.static import strings
+
+# Слова, которые есть в названиях многих регионов и не помогают их различить
+GENERIC_WORDS = {"республика", "область", "край", "автономный", "автономная", "округ", "г"}
+
+# Сокращения, неофициальные названия и административные центры регионов
+ALIASES = {
+    "1": ["адыгея", "майкоп"],
+    "2": ["башкирия", "уфа"],
+    "3": ["бурятия", "улан удэ"],
+    "4": ["горный алтай", "горно алтайск"],
+    "5": ["махачкала"],
+    "7": ["кбр", "кабардино балкария", "нальчик"],
+    "8": ["элиста"],
+    "9": ["кчр", "карачаево черкесия", "черкесск"],
+    "10": ["петрозаводск"],
+    "11": ["сыктывкар"],
+    "12": ["йошкар ола"],
+    "13": ["мордовия", "саранск"],
+    "14": ["якутия", "якутск"],
+    "15": ["осетия", "алания", "владикавказ"],
+    "16": ["казань"],
+    "17": ["тува", "кызыл"],
+    "18": ["удмуртия", "ижевск"],
+    "19": ["абакан"],
+    "20": ["чечня", "грозный"],
+    "21": ["чувашия", "чебоксары"],
+    "22": ["барнаул"],
+    "23": ["кубань", "краснодар", "сочи"],
+    "24": ["красноярск"],
+    "25": ["приморье", "владивосток"],
+    "26": ["ставрополье"],
+    "27": ["хабаровск"],
+    "28": ["благовещенск"],
+    "29": ["архангельск"],
+    "34": ["волгоград"],
+    "35": ["вологда", "череповец"],
+    "36": ["воронеж"],
+    "38": ["иркутск"],
+    "39": ["калининград"],
+    "40": ["калуга"],
+    "41": ["камчатка", "петропавловск камчатский"],
+    "42": ["кузбасс", "кемерово", "новокузнецк"],
+    "43": ["киров"],
+    "45": ["курган"],
+    "47": ["ленобласть", "ло"],
+    "50": ["подмосковье", "мо"],
+    "51": ["мурманск"],
+    "52": ["нижний новгород", "нижний"],
+    "53": ["великий новгород"],
+    "54": ["новосибирск"],
+    "56": ["оренбург"],
+    "57": ["орел"],
+    "58": ["пенза"],
+    "59": ["пермь"],
+    "60": ["псков"],
+    "61": ["ростов", "ростов на дону"],
+    "62": ["рязань"],
+    "63": ["самара", "тольятти"],
+    "64": ["саратов"],
+    "65": ["сахалин", "южно сахалинск"],
+    "66": ["екатеринбург", "екб", "свердловск"],
+    "67": ["смоленск"],
+    "68": ["тамбов"],
+    "69": ["тверь"],
+    "71": ["тула"],
+    "72": ["тюмень"],
+    "73": ["ульяновск"],
+    "74": ["челябинск", "магнитогорск"],
+    "75": ["забайкалье", "чита"],
+    "76": ["ярославль"],
+    "78": ["спб", "питер", "петербург", "санкт петербург", "ленинград"],
+    "79": ["еао", "биробиджан"],
+    "82": ["крым", "симферополь"],
+    "83": ["нао", "нарьян мар"],
+    "86": ["хмао", "югра", "ханты мансийск"],
+    "87": ["чао", "чукотка", "анадырь"],
+    "89": ["янао", "ямал", "салехард"],
+    "90": ["за границей", "заграница", "за рубежом"],
+}
+
+MIN_SCORE = 0.5  # Ниже этого коэффициента "сходства" точно определить регион невозможно
+
+
+def normalize(text: str) -> str:
+    text = re.sub(r"[\W_]+", " ", text.lower().replace("ё", "е"))
+    return " ".join(text.split())
+
+
+def _trigrams(text: str) -> set:
+    text = f"  {text} "
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+# Список регионов (номер -> название) читается из regions.json при первом обращении к regions.regions
+@functools.lru_cache(maxsize=None)
+def _load() -> dict:
+    with open(os.path.join(os.path.dirname(__file__), "data", "regions.json"), encoding="utf-8") as f:
+        return json.loads(f.read())
+
+
+def __getattr__(name: str):
+    if name == "regions":
+        return _load()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+_Index = collections.namedtuple("_Index", ["keys", "exact", "key_trigrams", "trigram_index"])
+
+
+# Индекс строится один раз, при первом поиске: точные ключи (нормализованные названия, названия без общих слов,
+# сокращения) и триграммы ключей для быстрого поиска кандидатов при опечатках
+@functools.lru_cache(maxsize=None)
+def _index() -> _Index:
+    keys = []  # (ключ, номер региона)
+    for region_id, region_name in _load().items():
+        name = normalize(region_name)
+        core = " ".join(word for word in name.split() if word not in GENERIC_WORDS)
+        for key in {name, core, *ALIASES.get(region_id, [])}:
+            if key:
+                keys.append((key, region_id))
+    exact = {}
+    for key, region_id in keys:
+        exact.setdefault(key, region_id)
+    key_trigrams = [_trigrams(key) for key, _ in keys]
+    trigram_index = collections.defaultdict(list)
+    for i, trigrams in enumerate(key_trigrams):
+        for trigram in trigrams:
+            trigram_index[trigram].append(i)
+    return _Index(keys, exact, key_trigrams, trigram_index)
+
+
+# Возвращает номер региона (строкой) по его названию или None, если регион не определяется однозначно
+def match(text: str) -> typing.Optional[str]:
+    query = normalize(text)
+    if not query:
+        return None
+    index = _index()
+    if query in index.exact:
+        return index.exact[query]
+    if len(query) < 3:
+        return None
+
+    query_trigrams = _trigrams(query)
+    common = collections.Counter()
+    for trigram in query_trigrams:
+        for i in index.trigram_index.get(trigram, ()):
+            common[i] += 1
+
+    best_score, best_region = 0.0, None
+    for i, count in common.items():
+        key, region_id = index.keys[i]
+        score = 2 * count / (len(query_trigrams) + len(index.key_trigrams[i]))  # Коэффициент Дайса
+        if any(word.startswith(query) for word in key.split()):
+            score = max(score, 0.9)  # Начало слова из названия, например "татар"
+        if score > best_score or score == best_score and int(region_id) < int(best_region):
+            best_score, best_region = score, region_id
+    if best_score < MIN_SCORE:
+        return None
+    return best_region
+
+
+@functools.lru_cache(maxsize=None)
+def get_region_list_text() -> str:
+    return strings.view_region_list + "\n\n" + "\n".join([
+        f"*{k}* - {v}"
+        for k, v in _load().items()
+    ])
@@ -0,0 +1,45 @@
+import json
+
+from app import config
+from app.data.models import Exam, ExamResult, ResultsSnapshot
+from app.static import strings
+
+
+# Текст ответа на /results. results - [(exam_id, предмет, балл или None), ...]
+def render(results: list) -> str:
+    essay_id = config.essay_id()
+    text_results = []
+    for exam_id, subject, result in results:
+        if result is None:
+            text_results.append(f"*{subject}*: {strings.no_result_yet}")
+        elif exam_id == essay_id:
+            text_results.append(f"*{subject}*: {strings.essay_passed if result else strings.essay_not_passed}")
+        else:
+            text_results.append(f"*{subject}*: {result}")
+    return "\n".join(text_results)
+
+
+# Пересобирает снимки результатов пользователей из exam_results одним запросом. Вызывается в транзакции,
+# изменившей их результаты, поэтому снимок не расходится с exam_results
+def update_snapshots(session, chat_ids):
+    chat_ids = list(chat_ids)
+    if not chat_ids:
+        return
+    session.flush()
+    results = {chat_id: [] for chat_id in chat_ids}
+    rows = session.query(ExamResult.chat_id, ExamResult.exam_id, Exam.name, ExamResult.result) \
+        .join(Exam, Exam.id == ExamResult.exam_id) \
+        .filter(ExamResult.chat_id.in_(chat_ids)) \
+        .order_by(ExamResult.id)
+    for chat_id, exam_id, subject, result in rows:
+        results[chat_id].append((exam_id, subject, result))
+    session.query(ResultsSnapshot).filter(ResultsSnapshot.chat_id.in_(chat_ids)).delete(synchronize_session=False)
+    session.bulk_insert_mappings(ResultsSnapshot, [
+        {"chat_id": chat_id, "results": json.dumps(user_results, ensure_ascii=False, separators=(",", ":")),
+         "text": render(user_results)}
+        for chat_id, user_results in results.items()
+    ])
+
+
+def get_text(session, chat_id):
+    return session.query(ResultsSnapshot.text).filter(ResultsSnapshot.chat_id == chat_id).scalar()
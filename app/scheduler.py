@@ -0,0 +1,130 @@
+import datetime
+import heapq
+import os
+import random
+import time
+import typing
+
+from app import metrics
+
+
+# Очередь проверок пользователей: куча по времени следующей проверки. У каждого пользователя свой интервал,
+# зависящий от числа экзаменов без результата, ожидаемых сроков публикации и недавних ошибок (см. polling_interval)
+class PollingScheduler:
+    def __init__(self):
+        self.heap = []  # (время проверки, chat_id); устаревшие записи пропускаются при извлечении
+        self.entries = {}  # chat_id -> [время проверки или None, если проверка идет сейчас, cookie, регион]
+        self.errors = {}  # chat_id -> число ошибок подряд
+        self.pending = {}  # chat_id -> [(экзамен, дата экзамена)] без результатов
+        self.fingerprints = {}  # chat_id -> (ETag или Last-Modified, отпечаток) последнего ответа checkege
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, chat_id) -> bool:
+        return chat_id in self.entries
+
+    def schedule(self, chat_id, due: float, participant_cookie=None, region=None):
+        entry = self.entries.get(chat_id)
+        if entry is None:
+            entry = self.entries[chat_id] = [due, participant_cookie, region]
+        else:
+            entry[0] = due
+            if participant_cookie is not None:
+                entry[1] = participant_cookie
+            if region is not None:
+                entry[2] = region
+        heapq.heappush(self.heap, (due, chat_id))
+        if len(self.heap) > 2 * len(self.entries) + 1000:
+            self.heap = [(entry[0], chat_id) for chat_id, entry in self.entries.items() if entry[0] is not None]
+            heapq.heapify(self.heap)
+
+    # Проверить как можно скорее, если до плановой проверки еще далеко
+    def expedite(self, chat_id):
+        entry = self.entries.get(chat_id)
+        if entry is not None and entry[0] is not None and entry[0] > time.time():
+            self.schedule(chat_id, time.time())
+
+    def update(self, chat_id, participant_cookie, region):
+        entry = self.entries.get(chat_id)
+        if entry is not None:
+            if entry[1] != participant_cookie:  # Пользователь авторизовался заново
+                self.fingerprints.pop(chat_id, None)
+            entry[1] = participant_cookie
+            entry[2] = region
+
+    def remove(self, chat_id):
+        self.entries.pop(chat_id, None)
+        self.errors.pop(chat_id, None)
+        self.pending.pop(chat_id, None)
+        self.fingerprints.pop(chat_id, None)
+
+    def region(self, chat_id):
+        entry = self.entries.get(chat_id)
+        return entry[2] if entry is not None else None
+
+    # Извлекает до limit пользователей, которых пора проверить: [(chat_id, cookie)]
+    def pop_due(self, limit: int) -> list:
+        now = time.time()
+        users = []
+        while self.heap and len(users) < limit:
+            due, chat_id = self.heap[0]
+            entry = self.entries.get(chat_id)
+            if entry is None or entry[0] != due:
+                heapq.heappop(self.heap)
+                continue
+            if due > now:
+                break
+            heapq.heappop(self.heap)
+            entry[0] = None
+            users.append((chat_id, entry[1]))
+            metrics.checker_lag_seconds.observe(now - due)
+        return users
+
+    def next_due(self) -> typing.Optional[float]:
+        while self.heap:
+            due, chat_id = self.heap[0]
+            entry = self.entries.get(chat_id)
+            if entry is not None and entry[0] == due:
+                return due
+            heapq.heappop(self.heap)
+        return None
+
+    # Планирует следующую проверку после удачной или неудачной (failed) проверки по экзаменам из self.pending
+    def reschedule(self, chat_id, failed: bool, published: bool, canary_mode: bool):
+        if chat_id not in self.entries:
+            return
+        if failed:
+            self.errors[chat_id] = self.errors.get(chat_id, 0) + 1
+        else:
+            self.errors.pop(chat_id, None)
+        pending = [exam_date for _, exam_date in self.pending.get(chat_id, [])]
+        interval = polling_interval(pending, published, self.errors.get(chat_id, 0), canary_mode)
+        self.schedule(chat_id, time.time() + interval)
+
+
+def polling_interval(pending: list, published: bool, errors: int, canary_mode: bool) -> float:
+    base = float(os.environ.get("CHECKER_INTERVAL", 600))
+    idle = float(os.environ.get("CHECKER_IDLE_INTERVAL", 6 * 60 * 60))
+    if errors:
+        interval = min(base * 2 ** errors, idle)
+    elif not pending:
+        interval = idle  # Все результаты уже известны, остается только следить за их изменением
+    elif published:
+        # Результаты по одному из экзаменов уже публикуются в регионе пользователя
+        interval = float(os.environ.get("CHECKER_HOT_INTERVAL", 60))
+    elif canary_mode or not any(_in_publication_window(exam_date) for exam_date in pending):
+        # Публикации сейчас не ожидается или ее заметит выборка canary
+        interval = float(os.environ.get("CHECKER_QUIET_INTERVAL", 60 * 60))
+    else:
+        interval = base / min(len(pending), 4) ** 0.5  # Чем больше ждем результатов, тем чаще проверяем
+    return interval * random.uniform(0.9, 1.1)
+
+
+def _in_publication_window(exam_date: typing.Optional[datetime.datetime]) -> bool:
+    if exam_date is None:
+        return True
+    days = (datetime.datetime.utcnow() - exam_date).total_seconds() / (24 * 60 * 60)
+    return float(os.environ.get("CHECKER_WINDOW_START_DAYS", 5)) <= days \
+        <= float(os.environ.get("CHECKER_WINDOW_END_DAYS", 25))
+
@@ -1,230 +1,254 @@
-import base64
+import datetime
 import hashlib
-import json
-import logging
-import os
 import typing
 from io import BytesIO
 
-import requests
-from fuzzywuzzy import process
-
-from app.data.db_session import create_session
-from app.data.models import User, Exam, ExamResult
+from app import captcha_pool, checkege, drafts, regions, results, stats, user_cache
+from app.data.db_session import reader, writer
+from app.data.models import User, Exam, ExamResult, ResultsSnapshot
 from app.static import strings
 
-with open(os.path.join(os.path.dirname(__file__), "data", "regions.json"), encoding="utf-8") as f:
-    regions = json.loads(f.read())
-
-
-def start(chat_id):
-    with create_session() as session:
-        user = session.query(User).get(chat_id)
-        if user is not None:
-            user.status = strings.Status.NAME.value
-            user.namehash = None
-            user.document = None
-            user.region = None
-            user.captcha_answer = None
-            user.captcha_token = None
-            user.participant_cookie = None
-        else:
-            user = User(chat_id=chat_id, status=strings.Status.NAME.value)
-            session.add(user)
+# Поля пользователя, которые вводятся при регистрации и хранятся в черновике (см. app.drafts)
+DRAFT_FIELDS = ("namehash", "document", "region", "captcha_token", "captcha_answer", "participant_cookie")
 
 
-def is_user_authorized(chat_id) -> bool:
-    with create_session() as session:
-        user = session.query(User).get(chat_id)
-        if user is None:
-            return False
-        return user.status == strings.Status.AUTHORIZED.value
+async def start(chat_id):
+    await drafts.get_store().put(chat_id, {"status": strings.Status.NAME.value})
+
+
+async def is_user_authorized(chat_id) -> bool:
+    return (await _get_user_state(chat_id))["status"] == strings.Status.AUTHORIZED.value
+
+
+async def get_user_status(chat_id) -> strings.Status:
+    return strings.Status((await _get_user_state(chat_id))["status"])
+
+
+# Статус и регион пользователя: из черновика, если он регистрируется, иначе из кэша, а при промахе - одним
+# запросом к БД
+async def _get_user_state(chat_id) -> dict:
+    draft = await drafts.get_store().get(chat_id)
+    if draft is not None:
+        return {"status": draft["status"], "region": draft.get("region")}
+    cache = user_cache.get_cache()
+    state = cache.get(chat_id)
+    if state is None:
+        writes = cache.writes
+        state = await _load_user_state(chat_id)
+        if cache.writes == writes:
+            cache.put(chat_id, state)
+    return state
+
+
+@reader
+def _load_user_state(session, chat_id) -> dict:
+    row = session.query(User.status, User.region).filter(User.chat_id == chat_id).first()
+    if row is None:
+        return {"status": strings.Status.NOT_FOUND.value, "region": None}
+    return {"status": row.status, "region": row.region}
 
 
-def get_user_status(chat_id) -> strings.Status:
-    with create_session() as session:
-        user = session.query(User).get(chat_id)
-        if user is None:
-            return strings.Status.NOT_FOUND
-        return strings.Status(user.status)
+# Черновик регистрации. Если его нет, а пользователь есть в БД (сессия истекла, или регистрация началась до
+# появления черновиков), черновик заполняется из БД: для повторной авторизации достаточно ввести капчу
+async def _get_draft(chat_id) -> typing.Optional[dict]:
+    draft = await drafts.get_store().get(chat_id)
+    if draft is None:
+        draft = await _load_draft(chat_id)
+    return draft
 
 
-def set_name(chat_id, name) -> bool:
+@reader
+def _load_draft(session, chat_id) -> typing.Optional[dict]:
+    user = session.query(User).get(chat_id)
+    if user is None:
+        return None
+    return {"status": user.status, **{field: getattr(user, field) for field in DRAFT_FIELDS}}
+
+
+# Общая запись для шагов регистрации: изменяет черновик, возвращает False, если его нет
+async def _update_draft(chat_id, **fields) -> bool:
+    draft = await _get_draft(chat_id)
+    if draft is None:
+        return False
+    draft.update(fields)
+    await drafts.get_store().put(chat_id, draft)
+    return True
+
+
+async def set_name(chat_id, name) -> bool:
     if not 2 <= len(name.split()) <= 3:
         return False
-    with create_session() as session:
-        user = session.query(User).get(chat_id)
-        namehash = hashlib.md5(name.lower().replace(" ", "").replace("ё", "е")
-                               .replace("й", "и").replace("-", "").encode()).hexdigest()
-        user.namehash = namehash
-        user.status = strings.Status.DOCUMENT.value
-        return True
+    namehash = hashlib.md5(name.lower().replace(" ", "").replace("ё", "е")
+                           .replace("й", "и").replace("-", "").encode()).hexdigest()
+    return await _update_draft(chat_id, namehash=namehash, status=strings.Status.DOCUMENT.value)
 
 
-def set_document(chat_id, document) -> bool:
+async def set_document(chat_id, document) -> bool:
     if len(document) not in (6, 12):
         return False
-    with create_session() as session:
-        user = session.query(User).get(chat_id)
-        user.document = document.rjust(12, "0")
-        user.status = strings.Status.REGION.value
-        return True
+    return await _update_draft(chat_id, document=document.rjust(12, "0"), status=strings.Status.REGION.value)
 
 
-def set_region(chat_id, region) -> bool:
-    if region.isalpha():
-        if len(region) < 3:
-            return False
-        name, rate, region = process.extractOne(region, regions)
-        if rate < 50:  # Если коэффициент "сходства" строк низкий, точно определить регион невозможно
-            return False
-    elif region.isdigit():
-        if region not in regions.keys():
+async def set_region(chat_id, region) -> bool:
+    if region.isdigit():
+        if region not in regions.regions:
             return False
     else:
-        return False
+        region = regions.match(region)
+        if region is None:
+            return False
 
-    with create_session() as session:
-        user = session.query(User).get(chat_id)
-        user.region = int(region)
-        return True
+    return await _update_draft(chat_id, region=int(region))
 
 
-def get_region(chat_id) -> typing.Optional[str]:
-    with create_session() as session:
-        user = session.query(User).get(chat_id)
-        if user is None or user.region is None:
-            return None
-        return regions[str(user.region)]
+async def get_region(chat_id) -> typing.Optional[str]:
+    region = (await _get_user_state(chat_id))["region"]
+    if region is None:
+        return None
+    return regions.regions[str(region)]
 
 
-def set_captcha(chat_id) -> typing.Optional[BytesIO]:
-    try:
-        r = requests.get(os.environ.get("CHECK_EGE_CAPTCHA_URL"))
-        if r:
-            data = r.json()
-        else:
-            logging.error(f"CAPTCHA: {r.status_code} - {r.text}")
-            return None
-    except requests.exceptions.ConnectionError:
-        logging.error("CAPTCHA: ConnectionError")
+async def set_captcha(chat_id) -> typing.Optional[BytesIO]:
+    captcha = await captcha_pool.get_captcha()
+    if captcha is None:
         return None
 
-    with create_session() as session:
-        user = session.query(User).get(chat_id)
-        user.captcha_token = data["Token"]
-        user.status = strings.Status.CAPTCHA.value
-    img = BytesIO()
-    img.write(base64.b64decode(data["Image"]))
-    img.seek(0)
-    return img
+    token, image = captcha
+    await _update_draft(chat_id, captcha_token=token, status=strings.Status.CAPTCHA.value)
+    return BytesIO(image)
 
 
-def set_captcha_answer(chat_id, answer) -> bool:
+async def set_captcha_answer(chat_id, answer) -> bool:
     if not answer.isdigit():
         return False
-    with create_session() as session:
-        user = session.query(User).get(chat_id)
-        user.captcha_answer = answer
-        return True
-
-
-def log_in(chat_id) -> bool:
-    with create_session() as session:
-        user = session.query(User).get(chat_id)
-        data = {
-            "Hash": user.namehash,
-            "Document": user.document,
-            "Region": user.region,
-            "Captcha": user.captcha_answer,
-            "Token": user.captcha_token,
-        }
-
-        try:
-            r = requests.post(os.environ.get("CHECK_EGE_LOGIN_URL"), data=data)
-            if r:
-                user.participant_cookie = r.cookies.get("Participant")
-                user.status = strings.Status.AUTHORIZED.value
-                return True
-            else:
-                if r.status_code != 401:
-                    logging.error(f"AUTHORIZATION: {r.status_code} - {r.text}")
-                user.status = strings.Status.AUTHORIZATION_ERROR.value
-                return False
-        except requests.exceptions.ConnectionError:
-            logging.error("AUTHORIZATION: ConnectionError")
-
-
-def save_initial_exams(chat_id) -> bool:
-    exams = get_exams(chat_id)
+    return await _update_draft(chat_id, captcha_answer=answer)
+
+
+# Авторизация на checkege с данными из черновика. Cookie участника остается в черновике до save_initial_exams
+async def log_in(chat_id) -> bool:
+    draft = await _get_draft(chat_id)
+    if draft is None:
+        return False
+    status, cookie = await checkege.log_in({
+        "Hash": draft["namehash"],
+        "Document": draft["document"],
+        "Region": draft["region"],
+        "Captcha": draft["captcha_answer"],
+        "Token": draft["captcha_token"],
+    })
+    if status is None:
+        return False
+    if status < 400:
+        return await _update_draft(chat_id, participant_cookie=cookie)
+    await _update_draft(chat_id, status=strings.Status.AUTHORIZATION_ERROR.value)
+    return False
+
+
+# Получает экзамены и одной транзакцией записывает пользователя из черновика вместе с результатами
+async def save_initial_exams(chat_id) -> bool:
+    draft = await _get_draft(chat_id)
+    if draft is None or draft.get("participant_cookie") is None:
+        return False
+    try:
+        exams = await checkege.get_exams(draft["participant_cookie"])
+    except checkege.SessionExpiredError:
+        exams = None
     if exams is None:
+        # Пользователь еще не записан: следующее его сообщение начнет авторизацию заново с новой капчей
+        await _update_draft(chat_id, status=strings.Status.SESSION_EXPIRED.value, participant_cookie=None)
         return False
-    with create_session() as session:
-        user = session.query(User).get(chat_id)
-        for exam in exams:
-            exam_obj = session.query(Exam).get(exam["ExamId"])
-            if exam_obj is None:
-                session.add(Exam(id=exam["ExamId"], name=exam["Subject"]))
-            if exam["HasResult"] and not exam["IsHidden"]:
-                result = ExamResult(exam_id=exam["ExamId"], result=exam["TestMark"])
-            else:
-                result = ExamResult(exam_id=exam["ExamId"], result=None)
-            user.exam_results.append(result)
-        return True
-
-
-def get_exams(chat_id) -> typing.Optional[dict]:
-    with create_session() as session:
-        user = session.query(User).get(chat_id)
-        headers = {
-            "Cookie": f"Participant={user.participant_cookie}",
-            "User-Agent": os.environ.get("USER_AGENT"),
-        }
-        try:
-            r = requests.get(os.environ.get("CHECK_EGE_EXAM_URL"), headers=headers)
-            if r:
-                return r.json()["Result"]["Exams"]
-            else:
-                logging.error(f"EXAM: {r.status_code} {r.text} (user {chat_id})")
-                return None
-        except requests.exceptions.ConnectionError:
-            logging.error("EXAM: ConnectionError")
-
-
-def get_current_results(chat_id) -> list[dict]:
-    with create_session() as session:
-        user = session.query(User).get(chat_id)
-        return [
-            {
-                "examId": exam_result.exam.id,
-                "subject": exam_result.exam.name,
-                "result": exam_result.result
-            } for exam_result in user.exam_results
-        ]
-
-
-def get_text_results(chat_id) -> str:
-    results = get_current_results(chat_id)
-    text_results = []
-    for result in results:
-        if result["result"] is None:
-            text_results.append(f"*{result['subject']}*: {strings.no_result_yet}")
-        elif result["examId"] == int(os.environ.get("ESSAY_ID")):
-            text_results.append(f"*{result['subject']}*: "
-                                f"{strings.essay_passed if result['result'] else strings.essay_not_passed}")
+    await _save_user(chat_id, draft, exams)
+    await drafts.get_store().delete(chat_id)
+    user_cache.get_cache().invalidate(chat_id)
+    user_cache.get_cache().put(chat_id, {"status": strings.Status.AUTHORIZED.value, "region": draft["region"]})
+    return True
+
+
+@writer
+def _save_user(session, chat_id, draft: dict, exams: list):
+    user = session.query(User).get(chat_id)
+    changes = []  # Для распределений баллов (app.stats): старые результаты убираются, новые добавляются
+    if user is None:
+        user = User(chat_id=chat_id)
+        session.add(user)
+    else:
+        changes.extend((exam_id, user.region, result, None) for exam_id, result in session.query(
+            ExamResult.exam_id, ExamResult.result
+        ).filter(ExamResult.chat_id == chat_id, ExamResult.result.isnot(None)))
+    user.namehash = draft["namehash"]
+    user.document = draft["document"]
+    user.region = draft["region"]
+    user.captcha_answer = None
+    user.captcha_token = None
+    user.participant_cookie = draft["participant_cookie"]
+    user.status = strings.Status.AUTHORIZED.value
+    user.authorized_at = datetime.datetime.utcnow()
+    user.failed_checks = 0
+    user.checked_at = None
+    # При повторной регистрации старые результаты заменяются новыми
+    user.exams_validator = None
+    user.exams_fingerprint = None
+    session.flush()
+    session.query(ExamResult).filter(ExamResult.chat_id == chat_id).delete(synchronize_session=False)
+    known_exams = dict(session.query(Exam.id, Exam.date).filter(Exam.id.in_([
+        exam["ExamId"] for exam in exams
+    ])))
+    for exam in exams:
+        if exam["ExamId"] not in known_exams:
+            session.add(Exam(id=exam["ExamId"], name=exam["Subject"], date=checkege.parse_exam_date(exam)))
+        elif known_exams[exam["ExamId"]] is None and checkege.parse_exam_date(exam) is not None:
+            session.query(Exam).filter(Exam.id == exam["ExamId"]).update({"date": checkege.parse_exam_date(exam)})
+        if exam["HasResult"] and not exam["IsHidden"]:
+            result = ExamResult(chat_id=chat_id, exam_id=exam["ExamId"], result=exam["TestMark"])
+            changes.append((exam["ExamId"], draft["region"], None, exam["TestMark"]))
         else:
-            text_results.append(f"*{result['subject']}*: {result['result']}")
-    return "\n".join(text_results)
+            result = ExamResult(chat_id=chat_id, exam_id=exam["ExamId"], result=None)
+        session.add(result)
+    results.update_snapshots(session, [chat_id])
+    stats.record(session, changes)
+
+
+# Готовый текст из снимка результатов (см. app.results), который обновляется вместе с результатами
+async def get_text_results(chat_id) -> str:
+    text = await _get_text_results(chat_id)
+    if text is None:  # Пользователь зарегистрировался до появления снимков
+        text = await _update_results_snapshot(chat_id)
+    return text
+
+
+@reader
+def _get_text_results(session, chat_id) -> typing.Optional[str]:
+    return results.get_text(session, chat_id)
+
+
+@writer
+def _update_results_snapshot(session, chat_id) -> str:
+    results.update_snapshots(session, [chat_id])
+    return results.get_text(session, chat_id)
+
+
+# Сравнение баллов пользователя с баллами остальных (см. app.stats)
+@reader
+def get_text_stats(session, chat_id) -> str:
+    return stats.get_text(session, chat_id)
+
+
+async def delete_user(chat_id):
+    await drafts.get_store().delete(chat_id)
+    await _delete_user(chat_id)
+    user_cache.get_cache().invalidate(chat_id)
 
 
-def delete_user(chat_id):
-    with create_session() as session:
-        user = session.query(User).get(chat_id)
+@writer
+def _delete_user(session, chat_id):
+    session.query(ResultsSnapshot).filter(ResultsSnapshot.chat_id == chat_id).delete(synchronize_session=False)
+    user = session.query(User).get(chat_id)
+    if user is not None:  # Пользователь с истекшей сессией мог быть еще не записан (см. save_initial_exams)
+        stats.record(session, [(exam_id, user.region, result, None) for exam_id, result in session.query(
+            ExamResult.exam_id, ExamResult.result
+        ).filter(ExamResult.chat_id == chat_id, ExamResult.result.isnot(None))])
         session.delete(user)
 
 
 def get_region_list_text() -> str:
-    return strings.view_region_list + "\n\n" + "\n".join([
-        f"*{k}* - {v}"
-        for k, v in regions.items()
-    ])
+    return regions.get_region_list_text()
@@ -0,0 +1,107 @@
+import asyncio
+import datetime
+import logging
+import math
+import os
+import socket
+import time
+
+from app.data.db_session import writer
+from app.data.models import CheckerShard, CheckerWorker, User
+
+
+# Аренда шардов пользователей для процесса автопроверки. Пользователь относится к шарду chat_id % count.
+# Процесс периодически продлевает аренду своих шардов; шарды, аренда которых не продлевалась дольше ttl,
+# забирают другие процессы. Каждый процесс держит не больше своей доли шардов, излишек освобождает.
+# Когда шарды уходят другим процессам (излишек, освобождение, аренда не продлевалась дольше ttl), вызываются
+# обработчики из on_lost с множеством потерянных шардов
+class ShardLease:
+    def __init__(self, count: int, ttl: float):
+        self.count = count
+        self.ttl = ttl
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.owned = set()
+        self.workers = 1  # Сколько процессов автопроверки сейчас живо, включая этот
+        self.renewed_at = time.monotonic()
+        self.on_lost = []
+
+    def user_filter(self):
+        return (User.chat_id % self.count).in_(self.owned)
+
+    def owns(self, chat_id) -> bool:
+        return chat_id % self.count in self.owned
+
+    async def renew(self):
+        started = time.monotonic()
+        owned, self.workers = await _renew(self.worker_id, self.count, self.ttl)
+        self.renewed_at = started
+        if owned != self.owned:
+            logging.info(f"SHARDING: {self.worker_id} owns shards {sorted(owned)} "
+                         f"of {self.count} ({self.workers} workers)")
+        self._set_owned(owned)
+
+    async def release(self):
+        self._set_owned(set())
+        await _release(self.worker_id)
+
+    async def run(self, interval: float):
+        while True:
+            try:
+                await self.renew()
+            except Exception:
+                logging.exception("SHARDING: failed to renew lease")
+                if self.owned and time.monotonic() - self.renewed_at > self.ttl:
+                    logging.warning(f"SHARDING: {self.worker_id} lease expired, shards go to other workers")
+                    self._set_owned(set())
+            await asyncio.sleep(interval)
+
+    def _set_owned(self, owned: set):
+        lost = self.owned - owned
+        self.owned = owned
+        if lost:
+            for callback in self.on_lost:
+                callback(lost)
+
+
+@writer
+def _renew(session, worker_id: str, count: int, ttl: float) -> tuple:
+    now = datetime.datetime.utcnow()
+    expired = now - datetime.timedelta(seconds=ttl)
+    session.query(CheckerWorker).filter(CheckerWorker.heartbeat_at <= expired).delete(synchronize_session=False)
+    if session.query(CheckerWorker).filter(CheckerWorker.worker_id == worker_id) \
+            .update({"heartbeat_at": now}, synchronize_session=False) == 0:
+        session.add(CheckerWorker(worker_id=worker_id, heartbeat_at=now))
+    workers = session.query(CheckerWorker).count() or 1
+    shards = {shard.shard: shard for shard in session.query(CheckerShard).with_for_update()}
+    for i in range(count):
+        if i not in shards:
+            shards[i] = CheckerShard(shard=i)
+            session.add(shards[i])
+
+    fair_share = math.ceil(count / workers)
+
+    owned = set()
+    for i in range(count):
+        shard = shards[i]
+        if shard.owner == worker_id:
+            if len(owned) < fair_share:
+                owned.add(i)
+                shard.heartbeat_at = now
+            else:
+                shard.owner = None  # Излишек отдаем другим процессам
+    for i in range(count):
+        shard = shards[i]
+        if len(owned) >= fair_share:
+            break
+        if shard.owner is None or shard.heartbeat_at is None or shard.heartbeat_at <= expired:
+            shard.owner = worker_id
+            shard.heartbeat_at = now
+            owned.add(i)
+    return owned, workers
+
+
+@writer
+def _release(session, worker_id: str):
+    session.query(CheckerWorker).filter(CheckerWorker.worker_id == worker_id).delete(synchronize_session=False)
+    session.query(CheckerShard).filter(CheckerShard.owner == worker_id) \
+        .update({"owner": None, "heartbeat_at": None}, synchronize_session=False)
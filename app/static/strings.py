@@ -9,6 +9,7 @@ class Status(Enum):
     CAPTCHA = 4
     AUTHORIZED = 5
     AUTHORIZATION_ERROR = 6
+    SESSION_EXPIRED = 7
 
 
 welcome = "Привет! \U0001F44B Пройдите регистрацию как на сайте [checkege](http://checkege.rustest.ru) " \
@@ -34,6 +35,8 @@ incorrect_captcha_format = "\U0000274C Некорректный формат! В
 authorization_error = "\U0000274C Участник не найден. Проверьте правильность введенных данных. Чтобы ввести заново, " \
                       "отправьте комануду /start"
 authorization_denied = "\U0000274C К сожалению, сервер CheckEge отказал в регистрации. Повторите попытку позже"
+session_expired = "\U000026A0 Сессия на checkege истекла, и бот не может проверять ваши результаты. Чтобы снова " \
+                  "получать уведомления, отправьте любое сообщение и введите цифры с картинки"
 new_result = "Пришли новые результаты!\n\U00002611 *{subject}*: {result}"
 result_changed = "Результат изменился!\n\U00002611 *{subject}*: {result}"
 
@@ -41,9 +44,17 @@ essay_passed = "_Зачёт_"
 essay_not_passed = "_Незачёт_"
 no_result_yet = "_Нет результата_"
 
+stats_no_results = "Статистика появится, когда придут результаты ваших экзаменов"
+stats_exam = "\U0001F4CA *{subject}*: {result}"
+stats_scope = "{scope}: выше, чем у {below}% из {total}, медиана - {median}"
+stats_not_enough = "{scope}: пока слишком мало результатов"
+stats_all_regions = "Все пользователи бота"
+stats_region = "Ваш регион"
+
 for_authorized = "Вы уже авторизованы. Используйте команды:\n" \
                  "/logout - удалить свои данные из бота\n" \
-                 "/results - получить текущие результаты"
+                 "/results - получить текущие результаты\n" \
+                 "/stats - сравнить свои баллы с баллами других пользователей бота"
 for_not_authorized = "Вы не авторизованы. Чтобы получить результаты, введите свои данные, используя команду /start"
 successfully_deleted = "Ваши данные успешно удалены"
 
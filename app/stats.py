@@ -0,0 +1,229 @@
+import argparse
+import array
+import collections
+import logging
+import os
+import sys
+import typing
+
+import sqlalchemy
+
+from app import config
+from app.data.models import Exam, ExamResult, ExamStats, User
+from app.static import strings
+
+# Распределения баллов по экзаменам (таблица exam_stats): для каждого экзамена и региона хранится массив
+# из BINS счетчиков - сколько сохраненных результатов равно 0, 1, ..., 100. Массивы обновляются в тех же
+# транзакциях, что и exam_results (record), поэтому ответ на /stats строится за O(BINS) без обхода результатов.
+# Распределения ведутся по всем экзаменам и не зависят от настроек бота (их пересчитывают миграции и
+# app.data.copy_db). Сочинение (ESSAY_ID) оценивается зачетом, а не баллом, и пропускается только в ответе
+# Проверка и пересчет таблицы: python -m app.stats [--rebuild]
+
+BINS = 101
+ALL_REGIONS = 0  # Регион строки с распределением по всем регионам
+
+# (exam_id, регион, старый балл или None, новый балл или None)
+Change = typing.Tuple[int, typing.Optional[int], typing.Optional[int], typing.Optional[int]]
+
+
+def _counted(score) -> bool:
+    return score is not None and 0 <= score < BINS
+
+
+def empty() -> array.array:
+    return array.array("I", [0]) * BINS
+
+
+def decode(blob) -> array.array:
+    histogram = array.array("I")
+    histogram.frombytes(blob)
+    if sys.byteorder == "big":
+        histogram.byteswap()
+    return histogram
+
+
+def encode(histogram: array.array) -> bytes:
+    if sys.byteorder == "big":
+        histogram = array.array("I", histogram)
+        histogram.byteswap()
+    return histogram.tobytes()
+
+
+# Учитывает изменения результатов в распределениях экзамена по всем регионам и по региону пользователя.
+# Вызывается в транзакции, изменившей exam_results
+def record(session, changes: typing.Iterable[Change]):
+    deltas = collections.defaultdict(collections.Counter)  # (exam_id, регион) -> {балл: изменение счетчика}
+    for exam_id, region, old, new in changes:
+        if old == new:
+            continue
+        for key in {(exam_id, ALL_REGIONS), (exam_id, region or ALL_REGIONS)}:
+            if _counted(old):
+                deltas[key][old] -= 1
+            if _counted(new):
+                deltas[key][new] += 1
+    deltas = {key: delta for key, delta in deltas.items() if any(delta.values())}
+    if not deltas:
+        return
+
+    session.flush()
+    try:
+        with session.begin_nested():
+            _apply(session, deltas)
+    except sqlalchemy.exc.IntegrityError:
+        # С общей БД (PostgreSQL) строку для того же экзамена и региона мог только что вставить другой процесс
+        _apply(session, deltas)
+
+
+def _apply(session, deltas: dict):
+    rows = session.query(ExamStats.exam_id, ExamStats.region, ExamStats.histogram) \
+        .filter(ExamStats.exam_id.in_({exam_id for exam_id, _ in deltas}),
+                ExamStats.region.in_({region for _, region in deltas})) \
+        .with_for_update()
+    stored = {(exam_id, region): histogram for exam_id, region, histogram in rows}
+    updates = []
+    inserts = []
+    for (exam_id, region), delta in deltas.items():
+        histogram = decode(stored[exam_id, region]) if (exam_id, region) in stored else empty()
+        for score, change in delta.items():
+            if histogram[score] + change < 0:
+                logging.warning(f"STATS: negative count for exam {exam_id}, region {region}, score {score}")
+            histogram[score] = max(histogram[score] + change, 0)
+        row = {"exam_id": exam_id, "region": region, "histogram": encode(histogram)}
+        (updates if (exam_id, region) in stored else inserts).append(row)
+    if updates:
+        session.bulk_update_mappings(ExamStats, updates)
+    if inserts:
+        session.bulk_insert_mappings(ExamStats, inserts)
+
+
+# Распределения, посчитанные заново по exam_results
+def compute(conn: sqlalchemy.engine.Connection) -> dict:
+    histograms = collections.defaultdict(empty)
+    rows = conn.execute(
+        sqlalchemy.select(ExamResult.exam_id, User.region, ExamResult.result, sqlalchemy.func.count())
+        .join(User, User.chat_id == ExamResult.chat_id)
+        .where(ExamResult.result.between(0, BINS - 1))
+        .group_by(ExamResult.exam_id, User.region, ExamResult.result)
+    )
+    for exam_id, region, result, count in rows:
+        histograms[exam_id, ALL_REGIONS][result] += count
+        if region:
+            histograms[exam_id, region][result] += count
+    return dict(histograms)
+
+
+# Заполняет exam_stats заново. SQLite и так пропускает пишущие транзакции по одной, в PostgreSQL на время
+# пересчета блокируется изменение распределений
+def rebuild(conn: sqlalchemy.engine.Connection):
+    if conn.dialect.name == "postgresql":
+        conn.execute(sqlalchemy.text("LOCK TABLE exam_stats IN EXCLUSIVE MODE"))
+    histograms = compute(conn)
+    conn.execute(sqlalchemy.delete(ExamStats))
+    if histograms:
+        conn.execute(sqlalchemy.insert(ExamStats), [
+            {"exam_id": exam_id, "region": region, "histogram": encode(histogram)}
+            for (exam_id, region), histogram in histograms.items()
+        ])
+
+
+# Сравнивает exam_stats с распределениями, посчитанными заново: возвращает расходящиеся (exam_id, регион)
+def verify(conn: sqlalchemy.engine.Connection) -> list:
+    if conn.dialect.name == "postgresql":
+        conn.execute(sqlalchemy.text("LOCK TABLE exam_stats IN SHARE MODE"))
+    expected = compute(conn)
+    stored = {
+        (exam_id, region): decode(histogram)
+        for exam_id, region, histogram in conn.execute(
+            sqlalchemy.select(ExamStats.exam_id, ExamStats.region, ExamStats.histogram)
+        )
+    }
+    return sorted(key for key in expected.keys() | stored.keys()
+                  if expected.get(key, empty()) != stored.get(key, empty()))
+
+
+# Сколько результатов в распределении, доля (%) результатов ниже score и медиана
+def describe(histogram: array.array, score: int) -> typing.Tuple[int, int, int]:
+    total = sum(histogram)
+    below = sum(histogram[:score])
+    cumulative = 0
+    median = 0
+    for median, count in enumerate(histogram):
+        cumulative += count
+        if 2 * cumulative >= total:
+            break
+    return total, below * 100 // total if total else 0, median
+
+
+# Распределение по интервалам в 10 баллов (последний - 90-100) от первого до последнего непустого
+def distribution(histogram: array.array) -> typing.List[typing.Tuple[str, int]]:
+    buckets = []
+    for start in range(0, 100, 10):
+        end = start + 9 if start < 90 else BINS - 1
+        buckets.append((f"{start}-{end}", sum(histogram[start:end + 1])))
+    filled = [i for i, (_, count) in enumerate(buckets) if count]
+    return buckets[filled[0]:filled[-1] + 1] if filled else []
+
+
+# Текст ответа на /stats: место пользователя в распределении баллов по каждому экзамену с результатом
+def get_text(session, chat_id) -> str:
+    essay_id = config.essay_id()
+    min_count = int(os.environ.get("STATS_MIN_COUNT", 10))
+    region = session.query(User.region).filter(User.chat_id == chat_id).scalar()
+    user_results = session.query(ExamResult.exam_id, Exam.name, ExamResult.result) \
+        .join(Exam, Exam.id == ExamResult.exam_id) \
+        .filter(ExamResult.chat_id == chat_id, ExamResult.result.between(0, BINS - 1),
+                ExamResult.exam_id != essay_id) \
+        .order_by(ExamResult.id).all()
+    if not user_results:
+        return strings.stats_no_results
+
+    scopes = [(strings.stats_all_regions, ALL_REGIONS)]
+    if region:
+        scopes.append((strings.stats_region, region))
+    rows = session.query(ExamStats.exam_id, ExamStats.region, ExamStats.histogram) \
+        .filter(ExamStats.exam_id.in_([exam_id for exam_id, _, _ in user_results]),
+                ExamStats.region.in_([scope_region for _, scope_region in scopes]))
+    histograms = {(exam_id, row_region): decode(histogram) for exam_id, row_region, histogram in rows}
+    blocks = []
+    for exam_id, subject, result in user_results:
+        lines = [strings.stats_exam.format(subject=subject, result=result)]
+        for title, scope_region in scopes:
+            total, below, median = describe(histograms.get((exam_id, scope_region), empty()), result)
+            if total < min_count:
+                lines.append(strings.stats_not_enough.format(scope=title))
+            else:
+                lines.append(strings.stats_scope.format(scope=title, below=below, total=total, median=median))
+        histogram = histograms.get((exam_id, ALL_REGIONS), empty())
+        total = sum(histogram)
+        if total >= min_count:
+            buckets = distribution(histogram)
+            widest = max(count for _, count in buckets)
+            lines.extend(f"`{bucket:>6} {'█' * round(count * 10 / widest):10} {count * 100 // total:>2}%`"
+                         for bucket, count in buckets)
+        blocks.append("\n".join(lines))
+    return "\n\n".join(blocks)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Проверка распределений баллов (exam_stats) по exam_results")
+    parser.add_argument("--rebuild", action="store_true", help="пересчитать таблицу, если она расходится")
+    args = parser.parse_args()
+
+    from app.data import db_session
+
+    config.load_env()
+    db_session.global_init()
+    with db_session.create_session() as session:
+        conn = session.connection()
+        mismatched = verify(conn)
+        for exam_id, region in mismatched:
+            print(f"exam {exam_id}, region {region}: mismatch")
+        if mismatched and args.rebuild:
+            rebuild(conn)
+            print("exam_stats rebuilt")
+    print(f"{len(mismatched)} mismatched histograms")
+    sys.exit(1 if mismatched and not args.rebuild else 0)
+
+
+if __name__ == "__main__":
+    main()
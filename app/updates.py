@@ -0,0 +1,214 @@
+import asyncio
+import collections
+import hashlib
+import logging
+import os
+import signal
+import time
+import typing
+
+from aiogram import Bot, Dispatcher, types
+from aiogram.dispatcher.handler import current_handler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+from aiohttp import web
+
+from app import metrics
+
+
+# Пул обработки входящих обновлений: не больше workers обработчиков одновременно, обновления одного чата
+# обрабатываются строго по очереди, разных чатов - параллельно. Когда необработанных обновлений max_pending,
+# прием новых ждет (при webhook Telegram получает ответ позже и сам придерживает следующие)
+class UpdatePool:
+    def __init__(self, dp: Dispatcher, workers: int, max_pending: int):
+        self.dp = dp
+        self.chats = {}  # chat_id -> необработанные обновления чата; ключ есть, пока у чата есть обновления
+        self.ready = asyncio.Queue()  # Чаты, обновления которых ждут свободного обработчика
+        self.slots = asyncio.Semaphore(max_pending)
+        self.idle = asyncio.Event()
+        self.idle.set()
+        self.pending = 0
+        self.unfinished = set()  # update_id принятых, но еще не обработанных обновлений
+        self.last_update_id = None  # Последнее принятое обновление
+        self.progress = asyncio.Event()  # Обработано очередное обновление
+        self.workers = [asyncio.ensure_future(self._work()) for _ in range(workers)]
+
+    async def submit(self, update: types.Update):
+        await self.slots.acquire()
+        self.pending += 1
+        metrics.bot_updates_pending.set(self.pending)
+        self.unfinished.add(update.update_id)
+        self.last_update_id = update.update_id
+        self.idle.clear()
+        chat_id = _chat_id(update)
+        queue = self.chats.get(chat_id)
+        if queue is None:
+            self.chats[chat_id] = collections.deque([update])
+            self.ready.put_nowait(chat_id)
+        else:
+            queue.append(update)  # Чат уже ждет обработчика или обрабатывается, обновление подождет своей очереди
+
+    # Offset для getUpdates: подтверждает Telegram только обновления, обработка которых завершена, и все
+    # предшествующие им. None, если обновлений еще не было
+    def offset(self) -> typing.Optional[int]:
+        if self.unfinished:
+            return min(self.unfinished)
+        return self.last_update_id + 1 if self.last_update_id is not None else None
+
+    # Дожидается обработки всех принятых обновлений
+    async def join(self):
+        await self.idle.wait()
+
+    async def close(self):
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+
+    async def _work(self):
+        while True:
+            chat_id = await self.ready.get()
+            queue = self.chats[chat_id]
+            update = queue.popleft()
+            try:
+                await self.dp.process_update(update)
+            except Exception:
+                logging.exception(f"UPDATES: failed to process update {update.update_id}")
+            finally:
+                self.slots.release()
+                self.unfinished.discard(update.update_id)
+                self.progress.set()
+                self.pending -= 1
+                metrics.bot_updates_pending.set(self.pending)
+            if queue:
+                self.ready.put_nowait(chat_id)  # В конец очереди, чтобы один чат не занимал обработчик
+            else:
+                del self.chats[chat_id]
+                if not self.chats:
+                    self.idle.set()
+
+
+def _chat_id(update: types.Update) -> typing.Hashable:
+    if update.message:
+        return update.message.chat.id
+    if update.callback_query:
+        return update.callback_query.from_user.id
+    return "update", update.update_id  # Прочие обновления не связаны с чатом и порядок для них не важен
+
+
+# Long polling: обновления, накопившиеся за время перезапуска, не пропускаются, а обрабатываются. Offset
+# не сдвигается дальше самого старого необработанного обновления, чтобы Telegram не посчитал его полученным
+# (иначе после падения или остановки по таймауту оно потерялось бы). Уже принятые обновления, которые
+# Telegram присылает повторно, пропускаются
+async def _poll(bot: Bot, pool: UpdatePool):
+    await bot.delete_webhook()  # getUpdates не работает, пока установлен webhook
+    while True:
+        offset = pool.offset()
+        try:
+            updates = await bot.get_updates(offset=offset, timeout=20)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logging.exception("UPDATES: failed to get updates")
+            await asyncio.sleep(5)
+            continue
+        new = [update for update in updates if pool.last_update_id is None or update.update_id > pool.last_update_id]
+        for update in new:
+            await pool.submit(update)
+        if updates and not new:
+            # Telegram отдает не больше 100 обновлений начиная с offset, и все они уже приняты: следующие
+            # придут, только когда обработается самое старое
+            while pool.unfinished and min(pool.unfinished) <= offset:
+                pool.progress.clear()
+                await pool.progress.wait()
+
+
+# Подтверждает Telegram обработанные обновления, чтобы после перезапуска он не прислал их снова: getUpdates
+# с offset отмечает полученными все обновления до offset. Необработанные за время остановки не подтверждаются
+async def _confirm(bot: Bot, pool: UpdatePool):
+    offset = pool.offset()
+    if offset is None:
+        return
+    try:
+        await bot.get_updates(offset=offset, limit=1, timeout=0)
+    except Exception:
+        logging.exception("UPDATES: failed to confirm processed updates")
+
+
+# Webhook: Telegram сам присылает обновления; пока бот перезапускается, он их копит и затем досылает
+async def _serve_webhook(bot: Bot, pool: UpdatePool) -> web.AppRunner:
+    # Путь по умолчанию выводится из токена, чтобы посторонние не могли присылать боту обновления
+    token_hash = hashlib.sha256(os.environ["BOT_API_TOKEN"].encode()).hexdigest()[:32]
+    path = os.environ.get("WEBHOOK_PATH") or f"/webhook/{token_hash}"
+
+    async def handle(request: web.Request) -> web.Response:
+        await pool.submit(types.Update(**await request.json()))
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_post(path, handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, os.environ.get("WEBHOOK_HOST", "127.0.0.1"),
+                      int(os.environ.get("WEBHOOK_PORT", 8080))).start()
+    await bot.set_webhook(os.environ["WEBHOOK_URL"].rstrip("/") + path,
+                          max_connections=int(os.environ.get("WEBHOOK_MAX_CONNECTIONS", 40)))
+    logging.info(f"UPDATES: webhook is listening on port {os.environ.get('WEBHOOK_PORT', 8080)}")
+    return runner
+
+
+# Замеряет время обработчиков сообщений и нажатий кнопок: dp.middleware.setup(updates.HandlerMetricsMiddleware())
+class HandlerMetricsMiddleware(BaseMiddleware):
+    async def on_process_message(self, message, data: dict):
+        self._start(data)
+
+    async def on_post_process_message(self, message, results, data: dict):
+        self._finish(data)
+
+    async def on_process_callback_query(self, callback_query, data: dict):
+        self._start(data)
+
+    async def on_post_process_callback_query(self, callback_query, results, data: dict):
+        self._finish(data)
+
+    @staticmethod
+    def _start(data: dict):
+        handler = current_handler.get(None)
+        data["metrics_handler"] = getattr(handler, "__name__", "unknown")
+        data["metrics_started"] = time.perf_counter()
+
+    @staticmethod
+    def _finish(data: dict):
+        if "metrics_started" in data:
+            metrics.handler_seconds.observe(time.perf_counter() - data["metrics_started"],
+                                            handler=data["metrics_handler"])
+
+
+# Принимает обновления (BOT_MODE: polling или webhook) до SIGINT/SIGTERM, затем дообрабатывает принятые
+async def run(dp: Dispatcher):
+    Bot.set_current(dp.bot)
+    Dispatcher.set_current(dp)
+    pool = UpdatePool(dp, int(os.environ.get("BOT_WORKERS", 50)), int(os.environ.get("BOT_MAX_PENDING", 1000)))
+    stop = asyncio.Event()
+    loop = asyncio.get_event_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+
+    mode = os.environ.get("BOT_MODE", "polling")
+    logging.info(f"UPDATES: receiving updates via {mode}")
+    if mode == "webhook":
+        runner = await _serve_webhook(dp.bot, pool)
+        await stop.wait()
+        # Webhook не удаляется: обновления, пришедшие во время перезапуска, Telegram доставит новому процессу
+        await runner.cleanup()
+    else:
+        polling = asyncio.ensure_future(_poll(dp.bot, pool))
+        await stop.wait()
+        polling.cancel()
+        await asyncio.gather(polling, return_exceptions=True)
+
+    try:
+        await asyncio.wait_for(pool.join(), timeout=float(os.environ.get("BOT_SHUTDOWN_TIMEOUT", 10)))
+    except asyncio.TimeoutError:
+        logging.warning(f"UPDATES: {pool.pending} updates left unprocessed")
+    if mode != "webhook":
+        await _confirm(dp.bot, pool)
+    await pool.close()
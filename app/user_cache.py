@@ -0,0 +1,49 @@
+import collections
+import os
+import time
+import typing
+
+
+# LRU-кэш состояния пользователей (статус и регион) по chat_id. Изменения этих полей в боте проходят через
+# services, которые сбрасывают запись кэша (invalidate) или кладут новую (put); пока регистрация не завершена,
+# состояние хранится в черновике (app.drafts), а не в кэше. Процесс автопроверки меняет статус сам (истекшая
+# сессия), поэтому записи живут не дольше ttl секунд
+class UserCache:
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = collections.OrderedDict()  # chat_id -> (время добавления, состояние)
+        self.writes = 0  # Счетчик изменений: состояние, прочитанное из БД во время записи, могло устареть
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, chat_id) -> typing.Optional[dict]:
+        entry = self.entries.get(chat_id)
+        if entry is None or time.monotonic() - entry[0] > self.ttl:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(chat_id)
+        return entry[1]
+
+    def put(self, chat_id, entry: dict):
+        self.entries[chat_id] = (time.monotonic(), entry)
+        self.entries.move_to_end(chat_id)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, chat_id):
+        self.writes += 1
+        self.entries.pop(chat_id, None)
+
+
+__cache: typing.Optional[UserCache] = None
+
+
+def get_cache() -> UserCache:
+    global __cache
+
+    if __cache is None:
+        __cache = UserCache(int(os.environ.get("USER_CACHE_SIZE", 100000)),
+                            float(os.environ.get("USER_CACHE_TTL", 60)))
+    return __cache
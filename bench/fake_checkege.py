@@ -0,0 +1,142 @@
+# Локальная заглушка checkege: капча, авторизация и экзамены с настраиваемой задержкой, долей ошибок,
+# публикацией результатов и отказом сервера. Cookie участника имеет вид "<документ>:<регион>": так
+# сгенерированные bench.population пользователи и прошедшие авторизацию получают одинаковые экзамены.
+# Отдельный запуск: python -m bench.fake_checkege --port 8765
+import argparse
+import asyncio
+import base64
+import collections
+import datetime
+import hashlib
+import json
+import random
+import typing
+
+from aiohttp import web
+
+# (ExamId, Subject, ExamDate): экзамены прошли 8-15 дней назад, результаты ожидаются со дня на день
+EXAMS = [
+    (exam_id, subject, (datetime.date.today() - datetime.timedelta(days=days_ago)).strftime("%Y-%m-%dT00:00:00"))
+    for exam_id, subject, days_ago in [
+        (1, "Русский язык", 15), (2, "Математика профильная", 12), (3, "Физика", 10), (4, "Обществознание", 10),
+        (5, "Информатика", 8), (6, "Химия", 14), (7, "История", 14), (8, "Биология", 9),
+    ]
+]
+CAPTCHA_ANSWER = "1234"
+CAPTCHA_IMAGE = base64.b64encode(b"\x89PNG\r\n\x1a\n").decode()  # Содержимое картинки заглушке не важно
+
+
+# Экзамены участника: 2-4 экзамена, выбранные по номеру документа
+def participant_exams(document: int) -> list:
+    rng = random.Random(document)
+    return sorted(rng.sample([exam_id for exam_id, _, _ in EXAMS], rng.randint(2, 4)))
+
+
+def participant_mark(document: int, exam_id: int) -> int:
+    return 30 + (document * 7 + exam_id * 13) % 70
+
+
+class FakeCheckege:
+    def __init__(self, latency: float = 0.05, error_rate: float = 0.0):
+        self.latency = latency  # Средняя задержка ответа, секунд (экспоненциальное распределение)
+        self.error_rate = error_rate  # Доля ответов 500
+        self.down = False  # Все запросы получают 503
+        self.published = {}  # exam_id -> множество регионов или None, если опубликовано во всех
+        self.requests = collections.Counter()
+        self.polled = set()  # Документы, по которым хотя бы раз запрашивались экзамены
+        self.runner: typing.Optional[web.AppRunner] = None
+
+    def publish(self, exam_id: int, regions: typing.Optional[typing.Iterable[int]] = None):
+        self.published[exam_id] = None if regions is None else set(regions)
+
+    def is_published(self, exam_id: int, region: int) -> bool:
+        return exam_id in self.published and (self.published[exam_id] is None or region in self.published[exam_id])
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/api/captcha", self.captcha)
+        app.router.add_post("/api/participant/login", self.login)
+        app.router.add_get("/api/exam", self.exam)
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8765) -> str:
+        self.runner = web.AppRunner(self.make_app(), access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, host, port).start()
+        return f"http://{host}:{port}"
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+
+    async def _simulate(self, name: str) -> typing.Optional[web.Response]:
+        self.requests[name] += 1
+        if self.latency > 0:
+            await asyncio.sleep(random.expovariate(1 / self.latency))
+        if self.down:
+            self.requests["unavailable"] += 1
+            return web.Response(status=503, text="Service Unavailable")
+        if random.random() < self.error_rate:
+            self.requests["errors"] += 1
+            return web.Response(status=500, text="Internal Server Error")
+        self.requests["ok"] += 1
+        return None
+
+    async def captcha(self, request: web.Request) -> web.Response:
+        return await self._simulate("captcha") or web.json_response({"Token": "token", "Image": CAPTCHA_IMAGE})
+
+    async def login(self, request: web.Request) -> web.Response:
+        error = await self._simulate("login")
+        if error is not None:
+            return error
+        data = await request.post()
+        if data.get("Captcha") != CAPTCHA_ANSWER:
+            return web.Response(status=401)
+        response = web.json_response({})
+        response.set_cookie("Participant", f"{int(data['Document'])}:{int(data['Region'])}")
+        return response
+
+    async def exam(self, request: web.Request) -> web.Response:
+        error = await self._simulate("exam")
+        if error is not None:
+            return error
+        cookie = request.cookies.get("Participant", "")
+        try:
+            document, region = map(int, cookie.split(":"))
+        except ValueError:
+            return web.Response(status=401)
+        self.polled.add(document)
+        exams = []
+        for exam_id, subject, exam_date in EXAMS:
+            if exam_id not in participant_exams(document):
+                continue
+            has_result = self.is_published(exam_id, region)
+            exams.append({
+                "ExamId": exam_id, "Subject": subject, "ExamDate": exam_date, "HasResult": has_result,
+                "IsHidden": False, "TestMark": participant_mark(document, exam_id) if has_result else 0,
+                "IsComposition": False, "StatusName": "Обработано" if has_result else "Нет результата",
+            })
+        body = json.dumps({"Result": {"Exams": exams}}, ensure_ascii=False)
+        etag = '"' + hashlib.md5(body.encode()).hexdigest() + '"'
+        if request.headers.get("If-None-Match") == etag:
+            self.requests["not_modified"] += 1
+            return web.Response(status=304, headers={"ETag": etag})
+        return web.Response(text=body, content_type="application/json", headers={"ETag": etag})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Заглушка checkege")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.05, help="средняя задержка ответа, секунд")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов 500")
+    parser.add_argument("--publish", type=int, action="append", default=[], help="опубликовать экзамен")
+    args = parser.parse_args()
+
+    fake = FakeCheckege(args.latency, args.error_rate)
+    for exam_id in args.publish:
+        fake.publish(exam_id)
+    web.run_app(fake.make_app(), host="127.0.0.1", port=args.port, access_log=None)
+
+
+if __name__ == "__main__":
+    main()
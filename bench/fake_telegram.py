@@ -0,0 +1,90 @@
+# Заглушка Telegram Bot API для бенчмарков: принимает вызовы бота (TELEGRAM_API_URL), запоминает время
+# отправки каждого сообщения и может ограничивать частоту ответом 429, как настоящий Telegram. Обновления,
+# добавленные push_update, отдаются боту через getUpdates
+import asyncio
+import collections
+import itertools
+import time
+import typing
+
+from aiohttp import web
+
+
+class FakeTelegram:
+    def __init__(self, rate_limit: float = 0):
+        self.rate_limit = rate_limit  # Сообщений в секунду, сверх лимита - 429 (0 - без ограничения)
+        self.sent = []  # (время отправки, chat_id, метод, текст)
+        self.calls = collections.Counter()
+        self.message_ids = itertools.count(1)
+        self.window = collections.deque()
+        self.updates = []  # Обновления для getUpdates, update_id - номер в списке + 1
+        self.new_update = asyncio.Event()
+        self.runner: typing.Optional[web.AppRunner] = None
+
+    def make_app(self) -> web.Application:
+        app = web.Application(client_max_size=16 * 1024 * 1024)
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8081) -> str:
+        self.runner = web.AppRunner(self.make_app(), access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, host, port).start()
+        return f"http://{host}:{port}"
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+
+    # Добавляет входящее сообщение от пользователя chat_id, как если бы он написал боту
+    def push_update(self, chat_id: int, text: str):
+        user = {"id": chat_id, "is_bot": False, "first_name": "Bench"}
+        self.updates.append({"update_id": len(self.updates) + 1, "message": {
+            "message_id": next(self.message_ids), "date": int(time.time()), "text": text,
+            "chat": {"id": chat_id, "type": "private"}, "from": user,
+        }})
+        self.new_update.set()
+
+    def messages_to(self, chat_id) -> list:
+        return [message for message in self.sent if message[1] == chat_id]
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.calls[method] += 1
+        data = await request.post()
+        if method == "getMe":
+            return _ok({"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"})
+        if method in ("sendMessage", "sendPhoto"):
+            now = time.monotonic()
+            if self.rate_limit > 0:
+                while self.window and now - self.window[0] > 1:
+                    self.window.popleft()
+                if len(self.window) >= self.rate_limit:
+                    self.calls["429"] += 1
+                    return web.json_response({"ok": False, "error_code": 429,
+                                              "description": "Too Many Requests: retry after 1",
+                                              "parameters": {"retry_after": 1}}, status=429)
+                self.window.append(now)
+            chat_id = int(data["chat_id"])
+            text = data.get("text") or data.get("caption") or ""
+            self.sent.append((now, chat_id, method, text))
+            return _ok({"message_id": next(self.message_ids), "date": int(time.time()),
+                        "chat": {"id": chat_id, "type": "private"}, "text": text})
+        if method == "getUpdates":
+            return _ok(await self._get_updates(int(data.get("offset") or 0), float(data.get("timeout") or 0)))
+        return _ok(True)  # answerCallbackQuery, deleteMessage, deleteWebhook и т.п.
+
+
+    # Long polling, как у Telegram, но ждет не дольше секунды, чтобы бот быстро останавливался
+    async def _get_updates(self, offset: int, timeout: float) -> list:
+        if len(self.updates) < max(offset, 1) and timeout > 0:
+            self.new_update.clear()
+            try:
+                await asyncio.wait_for(self.new_update.wait(), timeout=min(timeout, 1))
+            except asyncio.TimeoutError:
+                pass
+        return self.updates[max(offset - 1, 0):]
+
+
+def _ok(result) -> web.Response:
+    return web.json_response({"ok": True, "result": result})
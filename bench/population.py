@@ -0,0 +1,71 @@
+# Генератор синтетической БД: авторизованные пользователи с экзаменами из bench.fake_checkege.
+# Запуск: python -m bench.population --users 100000 --db /tmp/bench.sqlite [--results 0.3]
+import argparse
+import datetime
+import os
+import random
+import time
+
+from app import regions, stats
+from app.checkege import parse_exam_date
+from app.results import update_snapshots
+from app.static import strings
+from bench import fake_checkege
+
+
+# Заполняет БД из DB_FILENAME: users пользователей с chat_id 1..users, у доли results экзаменов уже есть результат
+def populate(users: int, results: float = 0.0, seed: int = 1):
+    from app.data import db_session
+    from app.data.models import Exam, ExamResult, User
+
+    db_session.global_init()
+    rng = random.Random(seed)
+    region_ids = [int(region_id) for region_id in regions.regions]
+    now = datetime.datetime.utcnow()
+    with db_session.create_session() as session:
+        session.bulk_insert_mappings(Exam, [
+            {"id": exam_id, "name": subject, "date": parse_exam_date({"ExamDate": exam_date})}
+            for exam_id, subject, exam_date in fake_checkege.EXAMS
+        ])
+    chunk = 10000
+    for start in range(1, users + 1, chunk):
+        user_rows = []
+        result_rows = []
+        for chat_id in range(start, min(start + chunk, users + 1)):
+            region = rng.choice(region_ids)
+            user_rows.append({
+                "chat_id": chat_id, "document": str(chat_id).rjust(12, "0"), "region": region,
+                "participant_cookie": f"{chat_id}:{region}", "status": strings.Status.AUTHORIZED.value,
+                "authorized_at": now, "failed_checks": 0,
+            })
+            for exam_id in fake_checkege.participant_exams(chat_id):
+                result = fake_checkege.participant_mark(chat_id, exam_id) if rng.random() < results else None
+                result_rows.append({"chat_id": chat_id, "exam_id": exam_id, "result": result})
+        user_regions = {row["chat_id"]: row["region"] for row in user_rows}
+        with db_session.create_session() as session:
+            session.bulk_insert_mappings(User, user_rows)
+            session.bulk_insert_mappings(ExamResult, result_rows)
+            update_snapshots(session, [row["chat_id"] for row in user_rows])
+            stats.record(session, [(row["exam_id"], user_regions[row["chat_id"]], None, row["result"])
+                                   for row in result_rows])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Синтетическая БД для бенчмарков")
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--db", required=True, help="файл SQLite (будет перезаписан)")
+    parser.add_argument("--results", type=float, default=0.0, help="доля экзаменов с уже известным результатом")
+    args = parser.parse_args()
+
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(args.db + suffix):
+            os.remove(args.db + suffix)
+    os.environ["DB_FILENAME"] = args.db
+    os.environ.setdefault("ESSAY_ID", "0")  # Сочинения среди экзаменов заглушки нет
+    started = time.perf_counter()
+    populate(args.users, args.results)
+    print(f"{args.users} users written to {args.db} in {time.perf_counter() - started:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+# Микробенчмарк определения региона по названию: новый индекс app.regions против fuzzywuzzy.process.extractOne.
+# Запуск из корня проекта: python -m bench.region_matcher
+import timeit
+
+from fuzzywuzzy import process
+
+from app import regions
+
+INPUTS = [
+    "татарстан", "Татарстан", "татар", "московская", "Подмосковье", "спб", "питер", "Санкт-Петербург",
+    "краснодарский", "красноярск", "новосиб", "Свердловская", "екатеринбург", "омск", "якутия", "осетия",
+    "хмао", "ямал", "чечня", "крым", "севастополь", "Нижегородская", "ленинградская", "кабардино-балкария",
+    "марий эл", "башкирия", "алтай", "алтайский", "ростов", "воронешская", "челяба", "ЕАО", "привет", "абв",
+]
+
+
+def extract_one(text: str):
+    if not text.isalpha() or len(text) < 3:
+        return None
+    name, rate, region = process.extractOne(text, regions.regions)
+    return region if rate >= 50 else None
+
+
+def main():
+    number = 20
+    for name, func in (("extractOne", extract_one), ("app.regions.match", regions.match)):
+        seconds = timeit.timeit(lambda: [func(text) for text in INPUTS], number=number)
+        print(f"{name:20} {seconds / number / len(INPUTS) * 1e6:10.1f} us/call")
+
+    print()
+    for text in INPUTS:
+        old, new = extract_one(text), regions.match(text)
+        mark = "" if old == new else "  *"
+        print(f"{text:22} {regions.regions.get(old, '-'):40} {regions.regions.get(new, '-')}{mark}")
+
+
+if __name__ == "__main__":
+    main()
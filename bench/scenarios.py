@@ -0,0 +1,236 @@
+# Сценарии нагрузки на локальных заглушках checkege и Telegram Bot API (всё в одном процессе):
+#   python -m bench.scenarios results_day --users 10000         первый проход и публикация результатов
+#   python -m bench.scenarios outage --users 10000 --outage 60  отказ checkege посреди проверки
+#   python -m bench.scenarios registration_storm --users 1000   одновременная регистрация пользователей
+# Заглушки работают в том же event loop, поэтому абсолютные цифры - оценка сверху; сравнивать имеет смысл
+# прогоны одного сценария до и после изменения
+import argparse
+import asyncio
+import logging
+import os
+import tempfile
+import time
+
+from bench import fake_checkege, population
+from bench.fake_checkege import FakeCheckege
+from bench.fake_telegram import FakeTelegram
+
+BOT_TOKEN = "123456:bench-bench-bench-bench-bench-bench"
+
+
+def percentile(values: list, p: float) -> float:
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def report(title: str, values: list, unit: str = "s"):
+    scale = 1000 if unit == "ms" else 1
+    print(f"  {title:32} n={len(values):<7} p50={percentile(values, 50) * scale:9.2f} {unit}  "
+          f"p99={percentile(values, 99) * scale:9.2f} {unit}  max={percentile(values, 100) * scale:9.2f} {unit}")
+
+
+# Настраивает окружение приложения на заглушки и временную БД. Настройки из .env не используются
+def setup_env(args, workdir: str):
+    env = {
+        "DB_FILENAME": os.path.join(workdir, "bench.sqlite"),
+        "CHECK_EGE_CAPTCHA_URL": f"http://127.0.0.1:{args.checkege_port}/api/captcha",
+        "CHECK_EGE_LOGIN_URL": f"http://127.0.0.1:{args.checkege_port}/api/participant/login",
+        "CHECK_EGE_EXAM_URL": f"http://127.0.0.1:{args.checkege_port}/api/exam",
+        "TELEGRAM_API_URL": f"http://127.0.0.1:{args.telegram_port}",
+        "BOT_API_TOKEN": BOT_TOKEN,
+        "USER_AGENT": "bench",
+        "ESSAY_ID": "0",
+        "CHECKER_INTERVAL": str(args.interval),
+        "CHECKER_RATE_LIMIT": str(args.rate_limit),
+        "CHECKER_CONCURRENCY": str(args.concurrency),
+        "CHECKER_JITTER": "0",
+        "CHECKER_SYNC_INTERVAL": "5",
+        "NOTIFIER_RATE_LIMIT": str(args.notifier_rate),
+    }
+    os.environ.update(env)
+    env_file = os.path.join(workdir, "bench.env")
+    with open(env_file, "w") as f:
+        f.writelines(f'{name}="{value}"\n' for name, value in env.items())
+    os.environ["ENV_FILE"] = env_file
+
+
+async def wait_for(condition, timeout: float) -> bool:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        await asyncio.sleep(0.05)
+    return True
+
+
+def make_bot():
+    from aiogram import Bot
+    from aiogram.bot.api import TelegramAPIServer
+
+    return Bot(BOT_TOKEN, server=TelegramAPIServer.from_base(os.environ["TELEGRAM_API_URL"]))
+
+
+async def cancel(*tasks):
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+# Первый проход по всем пользователям, затем публикация результатов одного экзамена во всех регионах:
+# сколько длится проход и через сколько после публикации пользователи получают уведомления
+async def results_day(args, fake: FakeCheckege, telegram: FakeTelegram):
+    from app import auto_checker, checkege, notifier
+
+    population.populate(args.users)
+    bot = make_bot()
+    started = time.monotonic()
+    tasks = [asyncio.ensure_future(auto_checker.check_for_new_results()), asyncio.ensure_future(notifier.run(bot))]
+    try:
+        complete = await wait_for(lambda: len(fake.polled) >= args.users, args.timeout)
+        print(f"  first pass: {len(fake.polled)}/{args.users} users in {time.monotonic() - started:.1f} s"
+              f"{'' if complete else ' (timeout)'}")
+
+        expected = sum(args.exam in fake_checkege.participant_exams(chat_id) for chat_id in range(1, args.users + 1))
+        published_at = time.monotonic()
+        fake.publish(args.exam)
+        complete = await wait_for(lambda: len(telegram.sent) >= expected, args.timeout)
+        print(f"  results published for exam {args.exam}: {len(telegram.sent)}/{expected} users notified"
+              f"{'' if complete else ' (timeout)'}")
+        report("notification latency", [sent_at - published_at for sent_at, *_ in telegram.sent])
+        print(f"  checkege requests: {dict(fake.requests)}")
+        print(f"  checkege client: {checkege.stats()}")
+        print(f"  telegram calls: {dict(telegram.calls)}")
+    finally:
+        await cancel(*tasks)
+        await (await bot.get_session()).close()
+
+
+# checkege отвечает 503 в течение args.outage секунд: сколько запросов уходит в недоступный сервер
+# и как быстро проверка возобновляется после восстановления
+async def outage(args, fake: FakeCheckege, telegram: FakeTelegram):
+    from app import auto_checker, checkege
+
+    population.populate(args.users)
+    task = asyncio.ensure_future(auto_checker.check_for_new_results())
+    try:
+        await wait_for(lambda: len(fake.polled) >= args.users // 4, args.timeout)
+        before = fake.requests.copy()
+        fake.down = True
+        print(f"  checkege is down for {args.outage} s")
+        await asyncio.sleep(args.outage)
+        fake.down = False
+        restored_at = time.monotonic()
+        during = fake.requests - before
+        ok = fake.requests["ok"]
+        await wait_for(lambda: fake.requests["ok"] > ok, args.timeout)
+        print(f"  requests answered with 503: {during['unavailable']} ({during['unavailable'] / args.outage:.1f}/s)")
+        print(f"  checks resumed {time.monotonic() - restored_at:.2f} s after recovery")
+        complete = await wait_for(lambda: len(fake.polled) >= args.users, args.timeout)
+        print(f"  first pass finished: {len(fake.polled)}/{args.users}{'' if complete else ' (timeout)'}")
+        print(f"  checkege client: {checkege.stats()}")
+    finally:
+        await cancel(task)
+
+
+# Пользователи одновременно проходят регистрацию через обработчики app.main: задержка каждого шага
+async def registration_storm(args, fake: FakeCheckege, telegram: FakeTelegram):
+    from aiogram import Bot, types
+
+    from app import captcha_pool, main
+    from app.data import db_session
+    from app.static import strings
+
+    logging.getLogger().setLevel(logging.WARNING)  # app.main включает подробное логирование
+    db_session.global_init()
+    Bot.set_current(main.bot)
+    steps = [("/start", "start"), ("Иванов Иван Иванович", "name"), (None, "document"), ("50", "region"),
+             (fake_checkege.CAPTCHA_ANSWER, "captcha")]
+    latencies = {step: [] for _, step in steps}
+    update_ids = iter(range(1, 10 ** 9))
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def register(chat_id: int):
+        async with semaphore:
+            for text, step in steps:
+                text = text or str(chat_id).rjust(6, "0")
+                message = {
+                    "message_id": next(update_ids), "date": int(time.time()), "text": text,
+                    "chat": {"id": chat_id, "type": "private"},
+                    "from": {"id": chat_id, "is_bot": False, "first_name": "Bench"},
+                }
+                if text.startswith("/"):
+                    message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text)}]
+                started = time.perf_counter()
+                await main.dp.process_update(types.Update(update_id=next(update_ids), message=message))
+                latencies[step].append(time.perf_counter() - started)
+
+    pool = asyncio.ensure_future(captcha_pool.run())
+    await asyncio.sleep(1)  # Запас капч успевает заполниться, как у давно работающего бота
+    started = time.monotonic()
+    await asyncio.gather(*(register(chat_id) for chat_id in range(1, args.users + 1)))
+    elapsed = time.monotonic() - started
+    await cancel(pool)
+    print(f"  {args.users} registrations in {elapsed:.1f} s ({args.users / elapsed:.1f}/s)")
+    for step, values in latencies.items():
+        report(f"handler: {step}", values, "ms")
+    report("handler: all", [value for values in latencies.values() for value in values], "ms")
+    authorized = sum(text.startswith(strings.successful_authorization) for _, _, _, text in telegram.sent)
+    print(f"  successful registrations: {authorized}/{args.users}")
+    print(f"  captcha pool: {dict(captcha_pool.get_pool().stats)}")
+    print(f"  checkege requests: {dict(fake.requests)}")
+    await (await main.bot.get_session()).close()
+
+
+SCENARIOS = {
+    "results_day": results_day,
+    "outage": outage,
+    "registration_storm": registration_storm,
+}
+
+
+async def run(args):
+    fake = FakeCheckege(args.latency, args.error_rate)
+    telegram = FakeTelegram(args.telegram_limit)
+    await fake.start(port=args.checkege_port)
+    await telegram.start(port=args.telegram_port)
+    print(f"{args.scenario}: {args.users} users, checkege latency {args.latency * 1000:.0f} ms, "
+          f"error rate {args.error_rate:.0%}")
+    try:
+        await SCENARIOS[args.scenario](args, fake, telegram)
+    finally:
+        from app import checkege
+
+        await checkege.close()
+        await fake.stop()
+        await telegram.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочные сценарии")
+    parser.add_argument("scenario", choices=SCENARIOS)
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--latency", type=float, default=0.05, help="средняя задержка checkege, секунд")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов checkege 500")
+    parser.add_argument("--interval", type=float, default=30, help="CHECKER_INTERVAL, секунд")
+    parser.add_argument("--rate-limit", type=float, default=0, help="CHECKER_RATE_LIMIT (0 - без ограничения)")
+    parser.add_argument("--concurrency", type=int, default=50, help="CHECKER_CONCURRENCY и число регистраций сразу")
+    parser.add_argument("--notifier-rate", type=float, default=30, help="NOTIFIER_RATE_LIMIT")
+    parser.add_argument("--telegram-limit", type=float, default=0,
+                        help="сверх скольких сообщений в секунду Telegram отвечает 429 (0 - без ограничения)")
+    parser.add_argument("--exam", type=int, default=2, help="экзамен, результаты которого публикуются")
+    parser.add_argument("--outage", type=float, default=30, help="длительность отказа checkege, секунд")
+    parser.add_argument("--timeout", type=float, default=600, help="предельное время ожидания каждой фазы")
+    parser.add_argument("--checkege-port", type=int, default=18765)
+    parser.add_argument("--telegram-port", type=int, default=18081)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    with tempfile.TemporaryDirectory() as workdir:
+        setup_env(args, workdir)
+        asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+# Время запуска бота и процессов автопроверки:
+#   python -m bench.startup --users 10000 --max-import 1.5 --max-first-reply 3
+# Импорт app.main и app.checker замеряется в новых процессах интерпретатора (берется лучший из --runs),
+# время до первого ответа - от запуска python -m app.main с уже заполненной БД до ответа на /start,
+# отправленный, пока бот был остановлен (как при поочередном перезапуске). Если заданы пороги и время
+# их превышает, код возврата 1: так регрессию времени запуска можно ловить в CI
+import argparse
+import asyncio
+import logging
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+from bench import population
+from bench.fake_checkege import FakeCheckege
+from bench.fake_telegram import FakeTelegram
+from bench.scenarios import report, setup_env
+
+MODULES = ["app.main", "app.checker"]
+
+
+def import_time(module: str) -> float:
+    code = f"import time; started = time.perf_counter(); import {module}; print(time.perf_counter() - started)"
+    output = subprocess.run([sys.executable, "-c", code], check=True, capture_output=True, text=True).stdout
+    return float(output.split()[-1])
+
+
+# Запускает бота, ждет ответа на сообщение, отправленное до запуска, и останавливает бота
+async def first_reply(telegram: FakeTelegram, chat_id: int, timeout: float) -> float:
+    telegram.push_update(chat_id, "/start")
+    started = time.monotonic()
+    process = await asyncio.create_subprocess_exec(sys.executable, "-m", "app.main",
+                                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while not telegram.messages_to(chat_id):
+            if process.returncode is not None:
+                raise RuntimeError(f"bot exited with code {process.returncode}")
+            if time.monotonic() - started > timeout:
+                raise TimeoutError(f"no reply in {timeout:.0f} s")
+            await asyncio.sleep(0.01)
+        return telegram.messages_to(chat_id)[0][0] - started
+    finally:
+        if process.returncode is None:
+            process.send_signal(signal.SIGTERM)
+            await process.wait()
+
+
+async def run(args) -> list:
+    failures = []
+    imports = {module: [import_time(module) for _ in range(args.runs)] for module in MODULES}
+    print(f"import ({args.runs} runs, fresh interpreter):")
+    for module, values in imports.items():
+        report(module, values)
+        if args.max_import and min(values) > args.max_import:
+            failures.append(f"import {module}: {min(values):.2f} s > {args.max_import} s")
+
+    fake = FakeCheckege(latency=0)
+    telegram = FakeTelegram()
+    await fake.start(port=args.checkege_port)
+    await telegram.start(port=args.telegram_port)
+    try:
+        # Первый запуск прогревает кэш ОС (модули, файл БД) и в замер не входит
+        await first_reply(telegram, args.users + 1, args.timeout)
+        replies = [await first_reply(telegram, args.users + 2 + i, args.timeout) for i in range(args.runs)]
+    finally:
+        await fake.stop()
+        await telegram.stop()
+    print(f"restart to first reply ({args.users} users in DB):")
+    report("python -m app.main", replies)
+    if args.max_first_reply and min(replies) > args.max_first_reply:
+        failures.append(f"first reply: {min(replies):.2f} s > {args.max_first_reply} s")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Время запуска")
+    parser.add_argument("--users", type=int, default=10000, help="пользователей в БД")
+    parser.add_argument("--runs", type=int, default=5, help="повторов каждого замера")
+    parser.add_argument("--max-import", type=float, default=0, help="порог времени импорта, секунд (0 - нет)")
+    parser.add_argument("--max-first-reply", type=float, default=0,
+                        help="порог времени до первого ответа, секунд (0 - нет)")
+    parser.add_argument("--timeout", type=float, default=60, help="предельное время ожидания ответа")
+    parser.add_argument("--checkege-port", type=int, default=18765)
+    parser.add_argument("--telegram-port", type=int, default=18081)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    with tempfile.TemporaryDirectory() as workdir:
+        setup_env(argparse.Namespace(**vars(args), interval=30, rate_limit=0, concurrency=50, notifier_rate=30),
+                  workdir)
+        population.populate(args.users)
+        failures = asyncio.run(run(args))
+    for failure in failures:
+        print(f"FAILED: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
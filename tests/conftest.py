@@ -0,0 +1,23 @@
+import os
+
+import pytest
+
+
+# Временная БД SQLite на все тесты: db_session настраивается один раз на процесс. Таблицы очищаются после каждого теста
+@pytest.fixture(scope="session")
+def database(tmp_path_factory):
+    os.environ.pop("DATABASE_URL", None)
+    os.environ["DB_FILENAME"] = str(tmp_path_factory.mktemp("db") / "test.sqlite")
+    os.environ.setdefault("ESSAY_ID", "0")
+    from app.data import db_session
+
+    db_session.global_init()
+    return db_session
+
+
+@pytest.fixture
+def db(database):
+    yield database
+    with database.create_session() as session:
+        for table in reversed(database.db.metadata.sorted_tables):
+            session.execute(table.delete())
@@ -0,0 +1,33 @@
+import asyncio
+import itertools
+
+from app import captcha_pool, checkege
+
+
+def test_pool_refills_only_after_recent_demand(monkeypatch):
+    tokens = itertools.count()
+
+    async def fetch():
+        return f"token{next(tokens)}", b"image"
+
+    async def available():
+        pass
+
+    monkeypatch.setattr(captcha_pool, "fetch", fetch)
+    monkeypatch.setattr(checkege, "wait_until_available", available)
+
+    async def scenario():
+        pool = captcha_pool.CaptchaPool(size=3, ttl=0.2, concurrency=3, idle=0.5)
+        task = asyncio.create_task(pool.run())
+        await asyncio.sleep(0.05)
+        warm = len(pool.items)  # Запуск считается спросом
+        await asyncio.sleep(0.65)
+        fetched = pool.stats["fetched"]
+        await asyncio.sleep(0.3)
+        idle = pool.stats["fetched"] - fetched, len(pool.items)
+        first = pool.get()  # Первая регистрация после перерыва получает капчу напрямую
+        await asyncio.sleep(0.05)
+        task.cancel()
+        return warm, idle, first, len(pool.items)
+
+    assert asyncio.run(scenario()) == (3, (0, 0), None, 3)
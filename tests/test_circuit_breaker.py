@@ -0,0 +1,118 @@
+import asyncio
+
+import pytest
+
+from app import checkege
+from app.circuit_breaker import CircuitBreaker
+
+
+# Подменяет модуль time в app.circuit_breaker: часы event loop при этом идут как обычно
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr("app.circuit_breaker.time", clock)
+    return clock
+
+
+@pytest.fixture
+def breaker(monkeypatch, clock):
+    breaker = CircuitBreaker(threshold=3, reset_timeout=60)
+    monkeypatch.setattr(checkege, "__breaker", breaker)
+    return breaker
+
+
+def test_opens_after_threshold_failures(breaker):
+    for _ in range(2):
+        breaker.record_failure()
+        assert breaker.state == CircuitBreaker.CLOSED
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+    assert breaker.times_opened == 1
+
+
+def test_success_resets_failures(breaker):
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_half_open_lets_one_trial_through(breaker, clock):
+    for _ in range(3):
+        breaker.record_failure()
+    clock.now += 60
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.is_blocked()
+    assert breaker.allow()
+    assert breaker.is_blocked()
+    assert not breaker.allow()
+
+
+def test_failed_trial_reopens(breaker, clock):
+    for _ in range(3):
+        breaker.record_failure()
+    clock.now += 60
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.retry_in() == 60
+    assert breaker.times_opened == 2
+
+
+def test_successful_trial_closes(breaker, clock):
+    for _ in range(3):
+        breaker.record_failure()
+    clock.now += 60
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow()
+
+
+def _open_for_trial(breaker, clock):
+    for _ in range(3):
+        breaker.record_failure()
+    clock.now += 60
+
+
+def test_rejected_request_raises_unavailable(breaker, clock):
+    _open_for_trial(breaker, clock)
+    breaker.allow()  # Пробный запрос уже идет
+    with pytest.raises(checkege.UnavailableError):
+        asyncio.run(checkege._request("GET", "http://checkege.invalid", "TEST"))
+
+
+def test_cancelled_trial_does_not_stick_half_open(breaker, clock, monkeypatch):
+    async def cancelled(method, url, **kwargs):
+        raise asyncio.CancelledError()
+
+    monkeypatch.setattr(checkege, "_attempt", cancelled)
+    _open_for_trial(breaker, clock)
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(checkege._request("GET", "http://checkege.invalid", "TEST"))
+    assert not breaker.trial_in_progress
+    assert breaker.allow()
+
+
+def test_wait_until_available_waits_for_trial(breaker, clock):
+    _open_for_trial(breaker, clock)
+    breaker.allow()
+
+    async def scenario():
+        waiter = asyncio.ensure_future(checkege.wait_until_available())
+        await asyncio.sleep(0.3)
+        assert not waiter.done()
+        breaker.record_success()
+        await asyncio.wait_for(waiter, 1)
+
+    asyncio.run(scenario())
@@ -0,0 +1,35 @@
+import asyncio
+
+import pytest
+
+from app import drafts
+
+
+def test_store_must_implement_every_method():
+    class Incomplete(drafts.DraftStore):
+        async def get(self, chat_id):
+            return None
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+def test_database_store_is_shared_between_instances(db):
+    async def scenario():
+        await drafts.DatabaseDraftStore(60).put(1, {"status": "name", "region": 77})
+        shared = await drafts.DatabaseDraftStore(60).get(1)
+        await drafts.DatabaseDraftStore(60).delete(1)
+        return shared, await drafts.DatabaseDraftStore(60).get(1)
+
+    assert asyncio.run(scenario()) == ({"status": "name", "region": 77}, None)
+
+
+def test_database_store_forgets_expired_drafts(db):
+    async def scenario():
+        await drafts.DatabaseDraftStore(-1).put(1, {"status": "name"})
+        expired = await drafts.DatabaseDraftStore(60).get(1)
+        await drafts.DatabaseDraftStore(60).put(2, {"status": "name"})  # Запись удаляет устаревшие черновики
+        with db.create_session() as session:
+            return expired, [chat_id for chat_id, in session.query(drafts.RegistrationDraft.chat_id)]
+
+    assert asyncio.run(scenario()) == (None, [2])
@@ -0,0 +1,54 @@
+import datetime
+
+import sqlalchemy as sa
+
+from app.data import migrations
+
+
+def _engine(tmp_path):
+    return sa.create_engine(f"sqlite:///{tmp_path / 'bot.db'}")
+
+
+def _versions(engine) -> list:
+    with engine.connect() as conn:
+        return [row.version for row in conn.execute(sa.select(migrations.schema_migrations.c.version)
+                                                    .order_by(migrations.schema_migrations.c.version))]
+
+
+def test_versions_are_contiguous():
+    versions = [version for version, _, _ in migrations.MIGRATIONS]
+    assert versions == list(range(1, len(versions) + 1))
+    assert len({name for _, name, _ in migrations.MIGRATIONS}) == len(versions)
+
+
+def test_applies_only_missing_versions_in_order(database, tmp_path, monkeypatch):
+    engine = _engine(tmp_path)
+    applied = []
+    monkeypatch.setattr(migrations, "MIGRATIONS", [(version, name, lambda conn, version=version: applied.append(version))
+                                                   for version, name, _ in migrations.MIGRATIONS])
+    with engine.begin() as conn:
+        migrations.schema_migrations.create(conn)
+        conn.execute(migrations.schema_migrations.insert(), [
+            {"version": version, "name": name, "applied_at": datetime.datetime.utcnow()}
+            for version, name, _ in migrations.MIGRATIONS[:2]])
+
+    migrations.migrate(engine)
+    assert applied == [version for version, _, _ in migrations.MIGRATIONS[2:]]
+    assert _versions(engine) == [version for version, _, _ in migrations.MIGRATIONS]
+
+    migrations.migrate(engine)  # Актуальная схема: ничего не применяется
+    assert applied == [version for version, _, _ in migrations.MIGRATIONS[2:]]
+
+
+def test_upgrades_database_without_migrations(database, tmp_path):
+    engine = _engine(tmp_path)
+    with engine.begin() as conn:  # notifications из версии бота до появления миграций
+        conn.execute(sa.text("CREATE TABLE notifications (id INTEGER PRIMARY KEY, chat_id INTEGER, text VARCHAR, "
+                             "created_at DATETIME)"))
+
+    migrations.migrate(engine)
+    inspector = sa.inspect(engine)
+    columns = {column["name"] for column in inspector.get_columns("notifications")}
+    assert {column.name for column in database.db.metadata.tables["notifications"].columns} <= columns
+    assert {"exam_stats", "registration_drafts"} <= set(inspector.get_table_names())
+    assert _versions(engine) == [version for version, _, _ in migrations.MIGRATIONS]
@@ -0,0 +1,119 @@
+import asyncio
+
+import pytest
+
+from app import notifier
+from app.data.models import Notification
+from app.rate_limiter import RateLimiter
+
+
+def _enqueue(db, notifications):
+    with db.create_session() as session:
+        notifier.enqueue(session, notifications)
+
+
+def test_claimed_notifications_are_not_given_to_another_worker(db):
+    _enqueue(db, [(1, "a"), (2, "b"), (1, "c"), (3, "d")])
+
+    async def scenario():
+        first = await notifier._claim("A", 2, 60)
+        second = await notifier._claim("B", 10, 60)
+        return [row.text for row in first], [row.text for row in second]
+
+    first, second = asyncio.run(scenario())
+    assert first == ["a", "b"]
+    assert second == ["d"]  # Чаты 1 и 2 заняты процессом A
+
+
+def test_released_notifications_can_be_claimed_again(db):
+    _enqueue(db, [(1, "a"), (1, "b")])
+
+    async def scenario():
+        claimed = await notifier._claim("A", 10, 60)
+        await notifier._finish([claimed[0].id], [claimed[1].id])
+        return [row.text for row in await notifier._claim("B", 10, 60)]
+
+    assert asyncio.run(scenario()) == ["b"]
+
+
+def test_expired_claim_is_taken_over(db):
+    _enqueue(db, [(1, "a")])
+
+    async def scenario():
+        await notifier._claim("A", 10, -1)
+        return [row.text for row in await notifier._claim("B", 10, 60)]
+
+    assert asyncio.run(scenario()) == ["a"]
+
+
+class FailingBot:
+    def __init__(self, failing):
+        self.failing = failing  # Тексты сообщений, отправка которых не удается
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        if text in self.failing:
+            raise RuntimeError("network error")
+        self.sent.append(text)
+
+
+# Запускает цикл отправки, пока бот не отправит expected сообщений, и возвращает оставшиеся в очереди
+def _run_until_sent(db, bot, expected):
+    async def scenario():
+        task = asyncio.create_task(notifier.run(bot))
+        while len(bot.sent) < expected:
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.1)  # Пока сохраняются результаты пачки
+        task.cancel()
+
+    asyncio.run(asyncio.wait_for(scenario(), 5))
+    with db.create_session() as session:
+        return [(row.text, row.attempts) for row in session.query(Notification).order_by(Notification.id)]
+
+
+@pytest.fixture
+def fast_notifier(monkeypatch):
+    monkeypatch.setenv("NOTIFIER_CHAT_INTERVAL", "0")
+    monkeypatch.setenv("NOTIFIER_RATE_LIMIT", "1000")
+
+
+def test_failing_notification_does_not_block_other_chats(db, fast_notifier):
+    _enqueue(db, [(1, "a"), (1, "b"), (2, "c"), (3, "d")])
+    bot = FailingBot({"a"})
+
+    assert _run_until_sent(db, bot, 2) == [("a", 1), ("b", None)]  # "b" ждет "a", чтобы не нарушить порядок
+    assert bot.sent == ["c", "d"]
+
+
+def test_notification_is_dropped_after_max_attempts(db, fast_notifier, monkeypatch):
+    monkeypatch.setenv("NOTIFIER_MAX_ATTEMPTS", "2")
+    _enqueue(db, [(1, "a"), (1, "b")])
+    with db.create_session() as session:
+        session.query(Notification).filter(Notification.text == "a").update({"attempts": 1})
+    bot = FailingBot({"a"})
+
+    assert _run_until_sent(db, bot, 1) == []
+    assert bot.sent == ["b"]
+
+
+def test_flood_control_wait_extends_claims(db):
+    from aiogram.utils import exceptions
+
+    _enqueue(db, [(1, "a")])
+
+    class FloodedBot(FailingBot):
+        async def send_message(self, chat_id, text, **kwargs):
+            if not self.sent:
+                self.sent.append(None)
+                raise exceptions.RetryAfter(1)
+            self.sent.append(text)
+
+    async def scenario():
+        await notifier._claim(notifier.__worker_id, 10, 0.3)
+        sending = asyncio.create_task(notifier._send(FloodedBot(set()), RateLimiter(0), 1, "a", 0.3))
+        await asyncio.sleep(0.5)  # Без продления аренда уже истекла бы
+        taken = await notifier._claim("B", 10, 60)
+        await sending
+        return taken
+
+    assert asyncio.run(scenario()) == []
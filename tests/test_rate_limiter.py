@@ -0,0 +1,60 @@
+import asyncio
+import types
+
+import pytest
+
+from app.rate_limiter import RateLimiter
+
+
+# Подменяет time и asyncio.sleep в app.rate_limiter: ожидание только переводит часы, поэтому время выдачи
+# разрешений точное
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+    async def sleep(self, seconds: float):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr("app.rate_limiter.time", clock)
+    monkeypatch.setattr("app.rate_limiter.asyncio", types.SimpleNamespace(Lock=asyncio.Lock, sleep=clock.sleep))
+    return clock
+
+
+def _acquire_times(clock: Clock, limiter: RateLimiter, count: int) -> list:
+    async def scenario():
+        times = []
+        for _ in range(count):
+            await limiter.acquire()
+            times.append(round(clock.now - 1000, 6))
+        return times
+
+    return asyncio.run(scenario())
+
+
+def test_requests_are_spaced_by_rate(clock):
+    assert _acquire_times(clock, RateLimiter(10), 4) == [0, 0.1, 0.2, 0.3]
+
+
+def test_burst_is_allowed_after_idle(clock):
+    limiter = RateLimiter(10, burst=3)
+    assert _acquire_times(clock, limiter, 4) == [0, 0, 0, 0.1]
+    clock.now += 60  # Простой не накапливает больше burst разрешений
+    assert _acquire_times(clock, limiter, 4) == [60.1, 60.1, 60.1, 60.2]
+
+
+def test_zero_rate_disables_limit(clock):
+    assert _acquire_times(clock, RateLimiter(0), 100) == [0] * 100
+
+
+def test_rate_change_applies_to_next_request(clock):
+    limiter = RateLimiter(10)
+    assert _acquire_times(clock, limiter, 2) == [0, 0.1]
+    limiter.rate = 2  # Так автопроверка делит общий лимит между процессами
+    assert _acquire_times(clock, limiter, 2) == [0.6, 1.1]
@@ -0,0 +1,33 @@
+import pytest
+
+from app import regions
+
+
+@pytest.mark.parametrize("text, region", [
+    ("Республика Татарстан", "16"),  # Полное название
+    ("республика  татарстан!", "16"),  # Регистр, пробелы и знаки препинания
+    ("Татарстан", "16"),  # Без общих слов
+    ("Свердловская обл.", "66"),
+    ("Санкт-Петербург", "78"),
+    ("Ханты-Мансийский", "86"),
+    ("кубань", "23"),  # Сокращения, неофициальные названия и административные центры
+    ("спб", "78"),
+    ("Нижний", "52"),
+    ("Тува", "17"),
+    ("Ставрополь", "26"),
+    ("Орёл", "57"),  # ё и е не различаются
+    ("краснодарскй край", "23"),  # Опечатка
+    ("татар", "16"),  # Начало слова из названия
+])
+def test_match(text, region):
+    assert regions.match(text) == region
+
+
+@pytest.mark.parametrize("text", ["", "  ", "!!!", "xyz", "ab", "абвгдежз"])
+def test_no_match(text):
+    assert regions.match(text) is None
+
+
+def test_every_region_matches_its_own_name():
+    assert {region_id: regions.match(name) for region_id, name in regions.regions.items()} \
+        == {region_id: region_id for region_id in regions.regions}
@@ -0,0 +1,93 @@
+import datetime
+
+import pytest
+
+from app.scheduler import PollingScheduler, polling_interval
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr("app.scheduler.time", clock)
+    monkeypatch.setattr("app.scheduler.random.uniform", lambda a, b: 1)  # Без разброса интервалов
+    for name, value in {"CHECKER_INTERVAL": "600", "CHECKER_IDLE_INTERVAL": "21600", "CHECKER_HOT_INTERVAL": "60",
+                        "CHECKER_QUIET_INTERVAL": "3600"}.items():
+        monkeypatch.setenv(name, value)
+    return clock
+
+
+def _days_ago(days: float) -> datetime.datetime:
+    return datetime.datetime.utcnow() - datetime.timedelta(days=days)
+
+
+def test_pop_due_returns_overdue_users_in_due_order(clock):
+    queue = PollingScheduler()
+    for chat_id, due in [(1, 990), (2, 980), (3, 1010), (4, 995)]:
+        queue.schedule(chat_id, due, f"cookie{chat_id}")
+    assert queue.pop_due(2) == [(2, "cookie2"), (1, "cookie1")]
+    assert queue.pop_due(10) == [(4, "cookie4")]  # 3 еще рано
+    assert queue.next_due() == 1010
+
+
+def test_rescheduled_and_removed_users_are_not_popped_twice(clock):
+    queue = PollingScheduler()
+    queue.schedule(1, 900)
+    queue.schedule(2, 950)
+    queue.schedule(1, 2000)  # Старая запись кучи устарела
+    queue.remove(2)
+    assert queue.pop_due(10) == []
+    assert queue.next_due() == 2000
+
+
+def test_expedite_moves_check_forward_but_not_checks_in_progress(clock):
+    queue = PollingScheduler()
+    queue.schedule(1, 5000)
+    queue.schedule(2, 900)
+    assert queue.pop_due(10) == [(2, None)]
+    queue.expedite(1)
+    queue.expedite(2)  # Уже проверяется
+    assert queue.pop_due(10) == [(1, None)]
+
+
+def test_failures_back_off_exponentially_up_to_idle_interval(clock):
+    queue = PollingScheduler()
+    queue.schedule(1, clock.now)
+    queue.pending[1] = [(10, _days_ago(10))]
+    intervals = []
+    for _ in range(7):
+        queue.pop_due(1)
+        queue.reschedule(1, failed=True, published=False, canary_mode=False)
+        intervals.append(queue.next_due() - clock.now)
+        clock.now = queue.next_due()
+    assert intervals == [1200, 2400, 4800, 9600, 19200, 21600, 21600]
+    queue.pop_due(1)
+    queue.reschedule(1, failed=False, published=False, canary_mode=False)
+    assert 1 not in queue.errors
+    assert queue.next_due() - clock.now == 600
+
+
+@pytest.mark.parametrize("pending, published, canary_mode, interval", [
+    ([], False, False, 21600),  # Все результаты известны
+    ([_days_ago(10)], True, False, 60),  # Результаты уже публикуются в регионе
+    ([_days_ago(10)], False, True, 3600),  # Публикацию заметит выборка canary
+    ([_days_ago(1)], False, False, 3600),  # Публикации еще рано
+    ([_days_ago(40)], False, False, 3600),  # Окно публикации прошло
+    ([_days_ago(10)], False, False, 600),
+    ([_days_ago(10)] * 4, False, False, 300),  # Чем больше ждем результатов, тем чаще
+    ([None] * 9, False, False, 300),  # Дата экзамена неизвестна: возможно, окно уже идет
+])
+def test_polling_interval(clock, pending, published, canary_mode, interval):
+    assert polling_interval(pending, published, 0, canary_mode) == interval
+
+
+def test_errors_override_other_intervals(clock):
+    assert polling_interval([_days_ago(10)], True, 2, False) == 2400
+    assert polling_interval([], False, 10, False) == 21600
@@ -0,0 +1,46 @@
+import asyncio
+
+from app import auto_checker
+from app.scheduler import PollingScheduler
+from app.sharding import ShardLease
+
+
+def _lease(worker_id: str) -> ShardLease:
+    lease = ShardLease(4, ttl=60)
+    lease.worker_id = worker_id
+    return lease
+
+
+def test_excess_shards_are_reported_as_lost_to_new_worker(db):
+    first, second = _lease("A"), _lease("B")
+    lost = []
+    first.on_lost.append(lost.append)
+
+    async def scenario():
+        await first.renew()
+        await second.renew()  # Все шарды заняты первым процессом
+        await first.renew()  # Первый отдает излишек
+        await second.renew()
+
+    asyncio.run(scenario())
+    assert lost == [{2, 3}]
+    assert (first.owned, second.owned) == ({0, 1}, {2, 3})
+    assert first.owns(5) and not first.owns(6)
+
+
+def test_release_drops_users_of_all_shards(db):
+    lease = _lease("A")
+    scheduler = PollingScheduler()
+    lease.on_lost.append(lambda shards: auto_checker._drop_shards(scheduler, lease.count, shards))
+
+    async def scenario():
+        await lease.renew()
+        for chat_id in range(8):
+            scheduler.schedule(chat_id, 0)
+        lease._set_owned({0, 1})
+        remaining = sorted(scheduler.entries)
+        await lease.release()
+        return remaining
+
+    assert asyncio.run(scenario()) == [0, 1, 4, 5]
+    assert len(scheduler) == 0
@@ -0,0 +1,75 @@
+from app import stats
+from app.data.models import Exam, ExamResult, ExamStats, User
+
+
+# Сохраняет результаты так же, как автопроверка: exam_results и распределения в одной транзакции.
+# results - [(chat_id, exam_id, балл или None)]; существующие результаты изменяются
+def _save(db, results):
+    with db.create_session() as session:
+        changes = []
+        for chat_id, exam_id, result in results:
+            if session.query(User).get(chat_id) is None:
+                session.add(User(chat_id=chat_id, region=16 if chat_id % 2 else 66))
+            if session.query(Exam).get(exam_id) is None:
+                session.add(Exam(id=exam_id, name=f"Экзамен {exam_id}"))
+            session.flush()
+            row = session.query(ExamResult).filter_by(chat_id=chat_id, exam_id=exam_id).one_or_none()
+            if row is None:
+                row = ExamResult(chat_id=chat_id, exam_id=exam_id)
+                session.add(row)
+            changes.append((exam_id, session.query(User).get(chat_id).region, row.result, result))
+            row.result = result
+        stats.record(session, changes)
+
+
+def _stored(db) -> dict:
+    with db.create_session() as session:
+        return {(exam_id, region): list(stats.decode(histogram))
+                for exam_id, region, histogram in session.query(ExamStats.exam_id, ExamStats.region,
+                                                                ExamStats.histogram)}
+
+
+def test_record_matches_rebuild(db):
+    _save(db, [(1, 1, 70), (2, 1, 70), (3, 1, None), (4, 2, 1)])
+    _save(db, [(1, 1, 80), (3, 1, 55), (2, 1, None), (5, 1, 101)])  # Изменение, новый, отозванный, вне шкалы
+    with db.create_session() as session:
+        conn = session.connection()
+        assert stats.verify(conn) == []
+        expected = {key: list(histogram) for key, histogram in stats.compute(conn).items()}
+    stored = {key: histogram for key, histogram in _stored(db).items() if any(histogram)}
+    assert stored == expected
+    assert stored[1, stats.ALL_REGIONS][80] == stored[1, stats.ALL_REGIONS][55] == 1
+    assert stored[1, 16] == stored[1, stats.ALL_REGIONS]  # Оба пользователя из региона 16
+
+
+def test_verify_reports_mismatch_and_rebuild_fixes_it(db):
+    _save(db, [(1, 1, 70), (2, 1, 60)])
+    with db.create_session() as session:
+        histogram = stats.empty()
+        histogram[99] = 5
+        session.query(ExamStats).filter_by(exam_id=1, region=16) \
+            .update({"histogram": stats.encode(histogram)}, synchronize_session=False)
+    with db.create_session() as session:
+        conn = session.connection()
+        assert stats.verify(conn) == [(1, 16)]
+        stats.rebuild(conn)
+        assert stats.verify(conn) == []
+
+
+def test_get_text_skips_essay(db, monkeypatch):
+    monkeypatch.setenv("ESSAY_ID", "2")
+    monkeypatch.setenv("STATS_MIN_COUNT", "1")
+    _save(db, [(1, 1, 70), (3, 1, 50), (5, 1, 90), (1, 2, 1)])
+    with db.create_session() as session:
+        text = stats.get_text(session, 1)
+    assert "Экзамен 1" in text and "Экзамен 2" not in text
+    assert "выше, чем у 33% из 3, медиана - 70" in text
+
+
+def test_describe_and_distribution():
+    histogram = stats.empty()
+    for score, count in [(40, 1), (55, 2), (100, 1)]:
+        histogram[score] = count
+    assert stats.describe(histogram, 55) == (4, 25, 55)
+    assert stats.distribution(histogram) == [("40-49", 1), ("50-59", 2), ("60-69", 0), ("70-79", 0), ("80-89", 0),
+                                             ("90-100", 1)]
@@ -0,0 +1,110 @@
+import asyncio
+
+from aiogram import types
+
+from app import updates
+
+
+class Dispatcher:
+    def __init__(self, block: set = frozenset()):
+        self.block = block  # update_id, обработка которых ждет release
+        self.release = asyncio.Event()
+        self.processed = []
+
+    async def process_update(self, update: types.Update):
+        if update.update_id in self.block:
+            await self.release.wait()
+        await asyncio.sleep(0)
+        self.processed.append(update.update_id)
+
+
+# getUpdates, как у Telegram: отдает до 100 обновлений начиная с offset и считает полученными все до него
+class Bot:
+    def __init__(self, updates: list = ()):
+        self.updates = list(updates)
+        self.confirmed = 0
+        self.offsets = []
+
+    async def delete_webhook(self):
+        pass
+
+    async def get_updates(self, offset=None, limit=100, timeout=0):
+        self.offsets.append(offset)
+        self.confirmed = max(self.confirmed, offset or 0)
+        updates = [update for update in self.updates if update.update_id >= self.confirmed][:limit]
+        if not updates and timeout:
+            await asyncio.sleep(0.01)
+        return updates
+
+
+def _update(update_id: int, chat_id: int) -> types.Update:
+    return types.Update(update_id=update_id, message={
+        "message_id": update_id, "date": 0, "text": "text",
+        "chat": {"id": chat_id, "type": "private"}, "from": {"id": chat_id, "is_bot": False, "first_name": "Test"},
+    })
+
+
+def _shutdown(dp: Dispatcher, update_ids: list) -> list:
+    async def scenario():
+        pool = updates.UpdatePool(dp, workers=4, max_pending=100)
+        for update_id in update_ids:
+            await pool.submit(_update(update_id, update_id))
+        try:
+            await asyncio.wait_for(pool.join(), timeout=0.1)
+        except asyncio.TimeoutError:
+            pass
+        bot = Bot()
+        await updates._confirm(bot, pool)
+        await pool.close()
+        return bot.offsets
+
+    return asyncio.run(scenario())
+
+
+def test_processed_updates_are_confirmed_on_shutdown():
+    assert _shutdown(Dispatcher(), [10, 11, 12]) == [13]
+
+
+def test_unprocessed_updates_are_not_confirmed():
+    assert _shutdown(Dispatcher(block={11}), [10, 11, 12]) == [11]
+
+
+def test_polling_does_not_confirm_updates_in_progress():
+    async def scenario():
+        dp = Dispatcher(block={2})
+        bot = Bot([_update(update_id, update_id) for update_id in range(1, 6)])
+        pool = updates.UpdatePool(dp, workers=4, max_pending=100)
+        polling = asyncio.create_task(updates._poll(bot, pool))
+        while len(dp.processed) < 4:
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.05)
+        stalled = bot.confirmed, len(bot.offsets)
+        dp.release.set()
+        while bot.confirmed < 6:
+            await asyncio.sleep(0.01)
+        polling.cancel()
+        await pool.close()
+        return stalled, dp.processed
+
+    (confirmed, polls), processed = asyncio.run(asyncio.wait_for(scenario(), 5))
+    assert confirmed == 2  # Обновление 2 еще обрабатывается
+    assert polls <= 3  # Пока оно не обработано, повторно полученные обновления не опрашиваются заново
+    assert sorted(processed) == [1, 2, 3, 4, 5]  # Повторно присланные обновления не обрабатываются дважды
+
+
+def test_chat_updates_are_processed_in_order():
+    async def scenario():
+        dp = Dispatcher(block={1})
+        pool = updates.UpdatePool(dp, workers=4, max_pending=100)
+        for update_id, chat_id in [(1, 7), (2, 7), (3, 8), (4, 7), (5, 8)]:
+            await pool.submit(_update(update_id, chat_id))
+        await asyncio.sleep(0.05)
+        blocked = list(dp.processed)
+        dp.release.set()
+        await pool.join()
+        await pool.close()
+        return blocked, dp.processed
+
+    blocked, processed = asyncio.run(asyncio.wait_for(scenario(), 5))
+    assert blocked == [3, 5]  # Остальные чаты не ждут обработки обновления 1
+    assert processed == [3, 5, 1, 2, 4]  # Обновления чата 7 обрабатываются по одному в порядке получения